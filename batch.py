@@ -0,0 +1,172 @@
+import argparse
+import multiprocessing
+import os
+import queue
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.util import Finalize
+
+# Generate songs (music_gen.create_song) or beats (markov_beats.create_random_beat)
+# in a pool of worker processes
+#
+# Usage: python batch.py --count 100 --workers 8 [--kind beat]
+
+def warm_up(chord_pat_file='chord_patterns.txt', beat_pat_file='beat_patterns.txt', encode_failures=None):
+    # Import the heavy modules (music21, librosa, pedalboard) once per worker, before its first song
+    import music_gen
+    import markov_beats
+    import musicality_score
+    # Parse the pattern files up front; workers forked from here share them
+    import patterns
+    patterns.load_chord_patterns(chord_pat_file)
+    patterns.load_beat_patterns(beat_pat_file)
+    # A worker's last song is still being encoded when its task returns: the worker waits for it
+    # on exit and sends the names of the songs that failed to encode back to the batch
+    if encode_failures is not None:
+        Finalize(None, finish_encoding, args=(encode_failures,), exitpriority=10)
+
+def finish_encoding(encode_failures):
+    import encoders
+    for name in encoders.wait_for_pending():
+        encode_failures.put(name)
+
+# Each song gets its own seed, so any song of a batch can be regenerated on any worker
+def make_song(seed, kind, renderer_backend, in_memory, chord_pat_file, beat_pat_file, fx_workers, fx_block_size,
+              analysis_sr, analysis_res_type, full_analysis, trace, resources, layer_timelines,
+              scratch_dir, keep_intermediates, output_formats):
+    import renderers
+    import encoders
+    renderer = renderers.get_renderer(renderer_backend)
+    start_time = time.time()
+    if kind == 'beat':
+        import markov_beats
+        name = markov_beats.generate_beat_id()
+        file_name, json_file = markov_beats.create_random_beat(name, renderer, seed, resources, scratch_dir, keep_intermediates,
+                                                               output_formats, wait_for_encoders=False)
+    else:
+        import music_gen
+        name = music_gen.generate_song_id()
+        # Key, tempo, time signature and measures are drawn from the song seed as well
+        file_name, json_file = music_gen.create_song(None, None, None, None, name, chord_pat_file, beat_pat_file,
+                                                     renderer, in_memory, seed=seed, fx_workers=fx_workers,
+                                                     fx_block_size=fx_block_size, analysis_sr=analysis_sr,
+                                                     analysis_res_type=analysis_res_type, full_analysis=full_analysis,
+                                                     trace=trace, resources=resources, layer_timelines=layer_timelines,
+                                                     scratch_dir=scratch_dir, keep_intermediates=keep_intermediates,
+                                                     output_formats=output_formats, wait_for_encoders=False)
+    # The song is encoded while the next one is generated: only wait for the previous song, and
+    # return it with the song if it failed to encode
+    encode_failures = encoders.wait_for_pending(1)
+    return name, file_name, json_file, time.time() - start_time, encode_failures
+
+# Song seeds are derived from the batch seed, so the same batch seed and count give the same songs
+def run_batch(count, workers, kind='song', renderer_backend='auto', in_memory=False,
+              chord_pat_file='chord_patterns.txt', beat_pat_file='beat_patterns.txt', seed=None,
+              fx_workers=4, fx_block_size=None, analysis_sr=22050, analysis_res_type='soxr_qq', full_analysis=False,
+              trace=False, resources=False, layer_timelines=False, scratch_dir=None, keep_intermediates=False,
+              output_formats=('wav',)):
+    args = (kind, renderer_backend, in_memory, chord_pat_file, beat_pat_file, fx_workers, fx_block_size,
+            analysis_sr, analysis_res_type, full_analysis, trace, resources, layer_timelines,
+            scratch_dir, keep_intermediates, output_formats)
+    batch_rng = random.Random(seed)
+    seeds = [batch_rng.randrange(2**32) for i in range(count)]
+    results = []
+    failures = []
+    # Songs that were generated but failed to encode, reported by the next song of their worker
+    # or when the worker finishes
+    encode_failures = []
+    start_time = time.time()
+    warm_up(chord_pat_file, beat_pat_file)
+    if workers <= 1:
+        for song_seed in seeds:
+            try:
+                results.append(make_song(song_seed, *args))
+                encode_failures += results[-1][4]
+            except Exception as e:
+                print(f'Generation failed (seed {song_seed}): {e}')
+                failures.append(str(e))
+        import encoders
+        encode_failures += encoders.wait_for_pending()
+    else:
+        worker_encode_failures = multiprocessing.Queue()
+        with ProcessPoolExecutor(max_workers=workers, initializer=warm_up,
+                                 initargs=(chord_pat_file, beat_pat_file, worker_encode_failures)) as pool:
+            futures = {pool.submit(make_song, song_seed, *args): song_seed for song_seed in seeds}
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                    encode_failures += results[-1][4]
+                except Exception as e:
+                    print(f'Generation failed (seed {futures[future]}): {e}')
+                    failures.append(str(e))
+        # The workers have exited, after finishing their last songs
+        while True:
+            try:
+                encode_failures.append(worker_encode_failures.get_nowait())
+            except queue.Empty:
+                break
+    failures += ['Encoding failed: ' + name for name in encode_failures]
+    results = [result for result in results if result[0] not in encode_failures]
+    elapsed_time = time.time() - start_time
+    print_summary(results, failures, elapsed_time, workers)
+    return results, failures
+
+def print_summary(results, failures, elapsed_time, workers):
+    print('\nBatch summary')
+    print(f'\tGenerated: {len(results)} ({len(failures)} failed) with {workers} worker(s)')
+    print(f'\tElapsed time: {elapsed_time:.2f} seconds')
+    if results:
+        song_times = [result[3] for result in results]
+        print(f'\tAverage time per song: {sum(song_times) / len(song_times):.2f} seconds')
+    if elapsed_time > 0:
+        print(f'\tThroughput: {len(results) * 3600 / elapsed_time:.1f} songs/hour')
+
+# --formats flac,opus
+def output_formats(value):
+    import encoders
+    try:
+        return encoders.parse_formats(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Generate songs or beats in parallel')
+    parser.add_argument('--count', type=int, default=10, help='number of songs to generate (default: 10)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes (default: CPU count)')
+    parser.add_argument('--kind', choices=['song', 'beat'], default='song',
+                        help='full songs (music_gen) or drum beats (markov_beats)')
+    parser.add_argument('--renderer', choices=['auto', 'subprocess', 'inprocess'], default='auto',
+                        help='MIDI renderer backend (default: auto)')
+    parser.add_argument('--in-memory', action='store_true', help='keep intermediate audio in memory')
+    parser.add_argument('--chord-patterns', default='chord_patterns.txt')
+    parser.add_argument('--beat-patterns', default='beat_patterns.txt')
+    parser.add_argument('--seed', type=int, default=None, help='batch seed, for reproducible batches')
+    parser.add_argument('--fx-workers', type=int, default=4, help='threads applying effects to the layers of a song (default: 4)')
+    parser.add_argument('--fx-block-size', type=int, default=None, help='frames per effects block (default: 1 second)')
+    parser.add_argument('--analysis-rate', type=int, default=22050,
+                        help='sample rate of the musicality analysis, 0 for the render rate (default: 22050)')
+    parser.add_argument('--res-type', choices=['soxr_qq', 'soxr_lq', 'soxr_mq', 'soxr_hq', 'soxr_vhq'], default='soxr_qq',
+                        help='resampler for the musicality analysis (default: soxr_qq, the fastest)')
+    parser.add_argument('--full-analysis', action='store_true',
+                        help='score the whole song at the end instead of aggregating the scores of its parts')
+    parser.add_argument('--formats', type=output_formats, default=('wav',),
+                        help='comma separated output formats of the mix: wav, flac, ogg (Vorbis), opus (default: wav)')
+    parser.add_argument('--scratch-dir', default=None,
+                        help='directory for intermediate files, e.g. /dev/shm (default: the system temporary directory)')
+    parser.add_argument('--keep-intermediates', action='store_true',
+                        help='keep the MIDI files and rendered layers of every song in its scratch directory')
+    parser.add_argument('--timeline', action='store_true',
+                        help='render each layer of a song in one pass over the whole arrangement (4 synth runs per song, tails kept across sections)')
+    parser.add_argument('--trace', action='store_true',
+                        help='save a Chrome/Perfetto trace of every song next to its annotations')
+    parser.add_argument('--resources', action='store_true',
+                        help='record peak memory, RSS, CPU and child CPU time, subprocesses and bytes written per stage (slower)')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    run_batch(args.count, args.workers, args.kind, args.renderer, args.in_memory, args.chord_patterns, args.beat_patterns, args.seed,
+              args.fx_workers, args.fx_block_size, args.analysis_rate or None, args.res_type,
+              args.full_analysis, args.trace, args.resources, args.timeline,
+              args.scratch_dir, args.keep_intermediates, args.formats)
@@ -0,0 +1,290 @@
+import argparse
+import contextlib
+import glob
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+# End-to-end benchmark of the generation pipeline: every stage is timed on its own with fixed
+# seeds (pattern parsing, note generation, MIDI writing, rendering, effects, mixing, encoding
+# the mix in every output format, scoring),
+# then whole songs and beats. Everything runs in a scratch directory with copies of the config
+# files and a tiny generated soundfont, and the results are written to JSON so runs can be
+# compared over time.
+#
+# Usage: python benchmarks/bench_pipeline.py [--repeat 5] [--songs 2] [--output results.json] [--compare old.json]
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+import numpy as np
+import music_gen
+import markov_beats
+import encoders
+import mixer
+import musicality_score
+import patterns
+import renderers
+from tiny_soundfont import write_tiny_soundfont
+
+LAYERS = ['harmony', 'melody', 'bassline', 'beat']
+SOUNDFONT_DIRS = ['beat', 'melody', 'harmony', 'bassline']
+# The part generated by the stage benchmarks
+KEY = 'C'
+TEMPO = 120
+TIME_SIGNATURE = '4/4'
+MEASURES = 8
+PART = 'verse'
+
+# Wall and CPU time of every run of a stage
+def measure(samples, name, function, *args, **kwargs):
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    result = function(*args, **kwargs)
+    samples.setdefault(name, []).append((time.perf_counter() - wall_start, time.process_time() - cpu_start))
+    return result
+
+# The last `count` samples of a stage added up into one (a run that times several layers)
+def merge_last(samples, name, count):
+    samples[name][-count:] = [tuple(map(sum, zip(*samples[name][-count:])))]
+
+def summarize(stage_samples):
+    walls = [wall for wall, cpu in stage_samples]
+    cpus = [cpu for wall, cpu in stage_samples]
+    return {'runs': len(walls), 'wall_mean': statistics.mean(walls), 'wall_median': statistics.median(walls),
+            'wall_min': min(walls), 'wall_max': max(walls), 'cpu_mean': statistics.mean(cpus)}
+
+# The generators write their MIDI files through music_gen.write_midi: time those writes on
+# their own, so the generation stages only count building the notes
+@contextlib.contextmanager
+def timed_midi_writes(samples):
+    write_midi = music_gen.write_midi
+    def timed_write_midi(*args):
+        return measure(samples, 'midi_write', write_midi, *args)
+    music_gen.write_midi = timed_write_midi
+    try:
+        yield
+    finally:
+        music_gen.write_midi = write_midi
+
+def midi_write_time(samples):
+    return sum(wall for wall, cpu in samples.get('midi_write', [])), sum(cpu for wall, cpu in samples.get('midi_write', []))
+
+# Time a generator, minus the MIDI writes it made
+def measure_generator(samples, name, function, *args):
+    write_wall, write_cpu = midi_write_time(samples)
+    result = measure(samples, name, function, *args)
+    wall, cpu = samples[name].pop()
+    new_write_wall, new_write_cpu = midi_write_time(samples)
+    samples[name].append((wall - (new_write_wall - write_wall), cpu - (new_write_cpu - write_cpu)))
+    return result
+
+# Renderer to benchmark, or the reason there is none (rendering needs FluidSynth)
+def get_benchmark_renderer(backend='auto'):
+    if backend in ('auto', 'inprocess') and renderers.fluidsynth is not None:
+        return renderers.get_renderer('inprocess'), None
+    if backend in ('auto', 'subprocess') and shutil.which('fluidsynth') is not None:
+        return renderers.get_renderer('subprocess'), None
+    return None, 'FluidSynth is not available (install fluidsynth or pyfluidsynth)'
+
+# Scratch directory with the config files and the tiny soundfont in every sf/ folder
+def prepare_workdir(workdir):
+    os.makedirs(workdir, exist_ok=True)
+    for config_file in glob.glob(os.path.join(REPO_DIR, '*.json')) + glob.glob(os.path.join(REPO_DIR, '*.txt')):
+        shutil.copy(config_file, workdir)
+    for sf_dir in SOUNDFONT_DIRS:
+        os.makedirs(os.path.join(workdir, 'sf', sf_dir), exist_ok=True)
+        write_tiny_soundfont(os.path.join(workdir, 'sf', sf_dir, 'tiny.sf2'))
+
+# Stand-in layer when nothing can render: a few seconds of decaying chords, long enough for
+# the effects, mixing and scoring stages to do representative work
+def synthetic_layer(duration, sample_rate, rng):
+    t = np.arange(int(duration * sample_rate)) / sample_rate
+    signal = np.zeros_like(t)
+    for start in np.arange(0, duration, 0.5):
+        frequency = 110 * 2 ** (rng.randrange(36) / 12)
+        envelope = np.where(t >= start, np.exp(-4 * (t - start)), 0)
+        signal += 0.2 * envelope * np.sin(2 * np.pi * frequency * t)
+    samples = np.clip(signal, -1, 1).astype(np.float32)
+    return np.stack([samples, samples])
+
+def bench_stages(samples, skipped, renderer, repeat, seed):
+    chord_file = 'chord_patterns.txt'
+    beat_file = 'beat_patterns.txt'
+    midi_files = {}
+    for run in range(repeat):
+        measure(samples, 'parse_chord_patterns', patterns.parse_pattern_file, chord_file, str)
+        measure(samples, 'parse_beat_patterns', patterns.parse_pattern_file, beat_file, int)
+    with timed_midi_writes(samples):
+        for run in range(repeat):
+            rng = random.Random(seed)
+            name = 'bench-' + PART
+            chord_progression, midi_files['harmony'] = measure_generator(samples, 'generate_chord_progression', music_gen.generate_chord_progression,
+                                                                         KEY, TEMPO, TIME_SIGNATURE, MEASURES, name, PART, chord_file, rng)
+            melody, midi_files['melody'] = measure_generator(samples, 'generate_melody', music_gen.generate_melody,
+                                                             KEY, TEMPO, TIME_SIGNATURE, MEASURES, name, PART, chord_progression, rng)
+            midi_files['bassline'] = measure_generator(samples, 'generate_bassline', music_gen.generate_bassline,
+                                                       KEY, TEMPO, TIME_SIGNATURE, MEASURES, name, PART, chord_progression, melody, rng)
+            midi_files['beat'], duration = measure_generator(samples, 'generate_beat', music_gen.generate_beat,
+                                                             TEMPO, TIME_SIGNATURE, MEASURES, name, PART, beat_file, rng)
+
+    # Rendering: the four layers of the part, or synthetic layers of the same length
+    sample_rate = renderer.sample_rate if renderer is not None else renderers.SAMPLE_RATE
+    layer_wavs = {layer: os.path.join('bench', 'bench-' + layer + '.wav') for layer in LAYERS}
+    if renderer is not None:
+        for run in range(repeat):
+            for layer in LAYERS:
+                soundfont = os.path.join('sf', layer, 'tiny.sf2')
+                measure(samples, 'render', renderer.render_to_file, midi_files[layer], soundfont, layer_wavs[layer])
+            merge_last(samples, 'render', len(LAYERS))
+    else:
+        skipped['render'] = get_benchmark_renderer()[1]
+        rng = random.Random(seed)
+        for layer in LAYERS:
+            renderers.write_audio(layer_wavs[layer], synthetic_layer(duration, sample_rate, rng), sample_rate)
+
+    # Effects, with the same pedalboards every run
+    rng = random.Random(seed)
+    boards = {layer: music_gen.generate_pedalboard(layer + '_fx.json', rng) for layer in LAYERS}
+    fx_wavs = {}
+    for run in range(repeat):
+        for layer in LAYERS:
+            fx_wavs[layer] = measure(samples, 'apply_fx_to_layer', music_gen.apply_fx_to_layer, layer_wavs[layer], boards[layer])
+        merge_last(samples, 'apply_fx_to_layer', len(LAYERS))
+
+    # Mixing the processed layers into a part
+    layer_audio = {layer: renderers.read_audio(fx_wavs[layer])[0] for layer in LAYERS}
+    levels = music_gen.get_levels('levels.json')
+    frames = mixer.duration_to_frames(duration, sample_rate)
+    def mix_part():
+        mix = mixer.create_mix_buffer(frames)
+        for layer in LAYERS:
+            mixer.mix_layer(mix, layer_audio[layer], float(levels[PART][layer]['volume']), float(levels[PART][layer]['panning']))
+        return mixer.limit(mix)
+    for run in range(repeat):
+        mix = measure(samples, 'mixing', mix_part)
+    part_wav = renderers.write_audio(os.path.join('bench', 'bench-' + PART + '.wav'), mix, sample_rate)
+
+    # Encoding the part mix in every output format, including waiting for the encoder thread
+    def encode_part(output_format):
+        output = encoders.open_output(os.path.join('bench', 'bench-encode'), (output_format,), sample_rate)
+        output.write(mix)
+        output.close()
+        output.wait()
+    for output_format in encoders.OUTPUT_FORMATS:
+        for run in range(repeat):
+            measure(samples, 'encode_' + output_format, encode_part, output_format)
+
+    for run in range(repeat):
+        measure(samples, 'get_musicality_score', musicality_score.get_musicality_score, part_wav)
+
+def bench_songs(samples, skipped, renderer, songs, seed):
+    if renderer is None:
+        reason = get_benchmark_renderer()[1]
+        skipped['create_song'] = reason
+        skipped['create_random_beat'] = reason
+        return
+    for run in range(songs):
+        measure(samples, 'create_song', music_gen.create_song, None, None, None, None, 'benchsong' + str(run),
+                'chord_patterns.txt', 'beat_patterns.txt', renderer, seed=seed + run)
+    for run in range(songs):
+        measure(samples, 'create_random_beat', markov_beats.create_random_beat, 'benchbeat' + str(run), renderer, seed + run)
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(workdir, renderer, repeat=5, songs=2, seed=1234, verbose=False):
+    samples = {}
+    skipped = {}
+    prepare_workdir(workdir)
+    current_dir = os.getcwd()
+    os.chdir(workdir)
+    # The pipeline reports every step; keep the benchmark output readable unless asked
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+    try:
+        with output:
+            bench_stages(samples, skipped, renderer, repeat, seed)
+            bench_songs(samples, skipped, renderer, songs, seed)
+    finally:
+        os.chdir(current_dir)
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'seed': seed,
+        'repeat': repeat,
+        'songs': songs,
+        'renderer': renderer.name if renderer is not None else None,
+        'audio_source': 'rendered' if renderer is not None else 'synthetic',
+        'stages': {name: summarize(stage_samples) for name, stage_samples in samples.items()},
+        'skipped': skipped,
+    }
+
+def print_results(results, previous=None):
+    header = '{:<28} {:>5} {:>12} {:>12} {:>12}'.format('Stage', 'Runs', 'Mean (ms)', 'Min (ms)', 'CPU (ms)')
+    if previous is not None:
+        header += ' {:>9}'.format('vs prev')
+    print(header)
+    for name, stage in results['stages'].items():
+        line = '{:<28} {:>5} {:>12.2f} {:>12.2f} {:>12.2f}'.format(name, stage['runs'], stage['wall_mean'] * 1000,
+                                                                stage['wall_min'] * 1000, stage['cpu_mean'] * 1000)
+        if previous is not None:
+            previous_stage = previous['stages'].get(name)
+            if previous_stage and previous_stage['wall_mean'] > 0:
+                line += ' {:>8.2f}x'.format(stage['wall_mean'] / previous_stage['wall_mean'])
+            else:
+                line += ' {:>9}'.format('-')
+        print(line)
+    for name, reason in results['skipped'].items():
+        print('{:<28} skipped: {}'.format(name, reason))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the generation pipeline stage by stage')
+    parser.add_argument('--repeat', type=int, default=5, help='runs of every stage (default: 5)')
+    parser.add_argument('--songs', type=int, default=2, help='whole songs and beats to generate (default: 2)')
+    parser.add_argument('--seed', type=int, default=1234, help='seed of every run (default: 1234)')
+    parser.add_argument('--renderer', choices=['auto', 'subprocess', 'inprocess'], default='auto',
+                        help='MIDI renderer backend (default: auto)')
+    parser.add_argument('--output', default=None, help='results file (default: benchmarks/results/bench-<timestamp>.json)')
+    parser.add_argument('--compare', default=None, help='previous results file to compare with')
+    parser.add_argument('--workdir', default=None, help='scratch directory, kept after the run (default: a temporary one)')
+    parser.add_argument('--verbose', action='store_true', help='show the output of the pipeline')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    renderer, reason = get_benchmark_renderer(args.renderer)
+    if renderer is None:
+        print('Rendering stages skipped: ' + reason)
+    workdir = args.workdir or tempfile.mkdtemp(prefix='random_music_bench_')
+    try:
+        results = run_benchmarks(workdir, renderer, args.repeat, args.songs, args.seed, args.verbose)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+    previous = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print_results(results, previous)
+    output = args.output
+    if output is None:
+        os.makedirs(os.path.join(BENCH_DIR, 'results'), exist_ok=True)
+        output = os.path.join(BENCH_DIR, 'results', 'bench-' + datetime.now().strftime('%Y%m%d%H%M%S') + '.json')
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=4)
+    print('Results saved as: ' + output)
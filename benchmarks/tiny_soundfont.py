@@ -0,0 +1,86 @@
+import argparse
+import struct
+import numpy as np
+
+# A tiny SoundFont 2 file (a few kilobytes) written from scratch, so the pipeline can be rendered
+# and benchmarked without downloading real soundfonts: a single looped sine sample mapped to
+# every key, with melodic (bank 0) and percussion (bank 128) presets so any channel sounds.
+#
+# Usage: python tiny_soundfont.py tiny.sf2
+
+SAMPLE_RATE = 44100
+# Whole periods of a sine close to middle C (262.5 Hz), so the loop is seamless
+PERIOD = 168
+ROOT_KEY = 60
+SAMPLE_PERIODS = 24
+LOOP_START_PERIOD = 4
+LOOP_END_PERIOD = 20
+# The SoundFont spec asks for at least 46 zero samples after each sample
+SAMPLE_PADDING = 46
+
+# Generator operators (SoundFont 2.04, section 8.1.2)
+GEN_RELEASE_VOL_ENV = 38
+GEN_INSTRUMENT = 41
+GEN_SAMPLE_ID = 53
+GEN_SAMPLE_MODES = 54
+# Release of about 0.3 seconds, in timecents
+RELEASE_TIMECENTS = -2084
+
+def chunk(chunk_id, data):
+    if len(data) % 2:
+        data += b'\0'
+    return chunk_id + struct.pack('<I', len(data)) + data
+
+def list_chunk(list_type, chunks):
+    return chunk(b'LIST', list_type + b''.join(chunks))
+
+def name_field(name):
+    return name.encode('ascii')[:19].ljust(20, b'\0')
+
+def sine_sample():
+    t = np.arange(PERIOD * SAMPLE_PERIODS)
+    samples = np.round(np.sin(2 * np.pi * t / PERIOD) * 16000).astype('<i2')
+    return samples.tobytes() + b'\0\0' * SAMPLE_PADDING
+
+def info_chunk(name):
+    return list_chunk(b'INFO', [
+        chunk(b'ifil', struct.pack('<HH', 2, 1)),
+        chunk(b'isng', b'EMU8000\0'),
+        chunk(b'INAM', name.encode('ascii') + b'\0'),
+    ])
+
+def pdta_chunk(name):
+    # One preset per bank, each with a single zone playing the only instrument
+    presets = [(name, 0, 0), (name + ' drums', 0, 128)]
+    phdr = b''.join(name_field(preset_name) + struct.pack('<HHHIII', program, bank, i, 0, 0, 0)
+                    for i, (preset_name, program, bank) in enumerate(presets))
+    phdr += name_field('EOP') + struct.pack('<HHHIII', 0, 0, len(presets), 0, 0, 0)
+    pbag = b''.join(struct.pack('<HH', i, 0) for i in range(len(presets) + 1))
+    pmod = b'\0' * 10
+    pgen = struct.pack('<Hh', GEN_INSTRUMENT, 0) * len(presets) + b'\0' * 4
+    # The instrument zone loops the sample; the sample ID comes last, as the spec requires
+    inst = name_field(name) + struct.pack('<H', 0) + name_field('EOI') + struct.pack('<H', 1)
+    igens = [(GEN_RELEASE_VOL_ENV, RELEASE_TIMECENTS), (GEN_SAMPLE_MODES, 1), (GEN_SAMPLE_ID, 0)]
+    ibag = struct.pack('<HH', 0, 0) + struct.pack('<HH', len(igens), 0)
+    imod = b'\0' * 10
+    igen = b''.join(struct.pack('<Hh', operator, amount) for operator, amount in igens) + b'\0' * 4
+    shdr = name_field('sine') + struct.pack('<IIIIIBbHH', 0, PERIOD * SAMPLE_PERIODS, PERIOD * LOOP_START_PERIOD,
+                                            PERIOD * LOOP_END_PERIOD, SAMPLE_RATE, ROOT_KEY, 0, 0, 1)
+    shdr += name_field('EOS') + b'\0' * 26
+    return list_chunk(b'pdta', [chunk(b'phdr', phdr), chunk(b'pbag', pbag), chunk(b'pmod', pmod), chunk(b'pgen', pgen),
+                                chunk(b'inst', inst), chunk(b'ibag', ibag), chunk(b'imod', imod), chunk(b'igen', igen),
+                                chunk(b'shdr', shdr)])
+
+def soundfont_bytes(name='tiny sine'):
+    return chunk(b'RIFF', b'sfbk' + info_chunk(name) + list_chunk(b'sdta', [chunk(b'smpl', sine_sample())]) + pdta_chunk(name))
+
+def write_tiny_soundfont(filename, name='tiny sine'):
+    with open(filename, 'wb') as f:
+        f.write(soundfont_bytes(name))
+    return filename
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a tiny sine wave soundfont')
+    parser.add_argument('output', help='soundfont file to write')
+    args = parser.parse_args()
+    print('Soundfont saved as: ' + write_tiny_soundfont(args.output))
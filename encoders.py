@@ -0,0 +1,182 @@
+import os
+import queue
+import threading
+import numpy as np
+import soundfile
+import soxr
+import renderers
+
+# Output formats of the final mix. The mix is encoded block by block as it is produced, straight
+# into every requested format, instead of writing a WAV and transcoding it afterwards. Each output
+# file is encoded on its own background thread, so encoding overlaps with rendering and mixing
+# the next parts (and the next song, for callers that do not wait: see wait_for_pending).
+#
+#     output = open_output(os.path.join(name, name), ('flac', 'opus'), 44100)
+#     output.write(samples)  # float32 (channels, frames), as many times as needed
+#     output.close()
+#     output.wait()
+#
+# WAV is 16-bit PCM, written with pedalboard as before. Opus only supports a few sample rates,
+# so it is resampled to 48 kHz on the way in.
+OUTPUT_FORMATS = {
+    'wav': {'extension': '.wav'},
+    'flac': {'extension': '.flac', 'format': 'FLAC', 'subtype': 'PCM_16'},
+    'ogg': {'extension': '.ogg', 'format': 'OGG', 'subtype': 'VORBIS'},
+    'opus': {'extension': '.opus', 'format': 'OGG', 'subtype': 'OPUS', 'sample_rate': 48000},
+}
+
+# 'flac,opus' -> ('flac', 'opus')
+def parse_formats(formats):
+    if isinstance(formats, str):
+        formats = formats.split(',')
+    formats = tuple(output_format.strip().lower() for output_format in formats if output_format.strip())
+    if not formats:
+        raise ValueError('No output format given')
+    for output_format in formats:
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError('Unknown output format: ' + output_format + ' (choose from ' + ', '.join(OUTPUT_FORMATS) + ')')
+    return formats
+
+# Audio is queued and encoded in pieces of this many frames: it bounds the memory waiting in each
+# encoder's queue, and libsndfile's Vorbis encoder crashes on very large writes (a whole song at once)
+WRITE_FRAMES = 65536
+
+# Writes one output file in blocks, on the calling thread
+class FormatWriter:
+    def __init__(self, filename, output_format, sample_rate, channels=2):
+        settings = OUTPUT_FORMATS[output_format]
+        self.filename = filename
+        self.channels = channels
+        self.audio_file = None
+        self.sound_file = None
+        self.resampler = None
+        if output_format == 'wav':
+            self.audio_file = renderers.open_audio_writer(filename, sample_rate, channels)
+        else:
+            file_rate = settings.get('sample_rate', sample_rate)
+            if file_rate != sample_rate:
+                self.resampler = soxr.ResampleStream(sample_rate, file_rate, channels, dtype='float32')
+            self.sound_file = soundfile.SoundFile(filename, 'w', file_rate, channels, settings['subtype'], format=settings['format'])
+
+    def write(self, samples):
+        if self.audio_file is not None:
+            self.audio_file.write(samples)
+            return
+        # soundfile takes (frames, channels)
+        frames = np.ascontiguousarray(samples.T, dtype=np.float32)
+        if self.resampler is not None:
+            frames = self.resampler.resample_chunk(frames)
+        for start in range(0, len(frames), WRITE_FRAMES):
+            self.sound_file.write(frames[start:start + WRITE_FRAMES])
+
+    def close(self):
+        if self.audio_file is not None:
+            self.audio_file.close()
+            return
+        try:
+            if self.resampler is not None:
+                # Flush the resampler
+                self.sound_file.write(self.resampler.resample_chunk(np.zeros((0, self.channels), dtype=np.float32), last=True))
+                self.resampler = None
+        finally:
+            self.sound_file.close()
+
+# Encodes one output file on a background thread. Blocks are copied into the queue in pieces of
+# WRITE_FRAMES frames, so an encoder holds at most queue_size pieces (a few megabytes) however
+# long the parts are, and the caller is free to reuse them. The file is opened right away, so a
+# bad format or path fails in the caller; errors while encoding are raised by wait().
+class BackgroundEncoder:
+    def __init__(self, filename, output_format, sample_rate, channels=2, queue_size=8):
+        self.filename = filename
+        self.writer = FormatWriter(filename, output_format, sample_rate, channels)
+        self.blocks = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name='encode-' + os.path.basename(filename))
+        self.thread.start()
+
+    def run(self):
+        try:
+            while True:
+                samples = self.blocks.get()
+                if samples is None:
+                    break
+                if self.error is None:
+                    try:
+                        self.writer.write(samples)
+                    except Exception as e:
+                        # Keep taking blocks, so the producer never waits on a full queue
+                        self.error = e
+        finally:
+            try:
+                self.writer.close()
+            except Exception as e:
+                if self.error is None:
+                    self.error = e
+            # Reported here too, as nobody may wait for the last song of a worker process
+            if self.error is not None:
+                print('Encoding failed (' + self.filename + '): ' + str(self.error))
+
+    def write(self, samples):
+        for start in range(0, samples.shape[1], WRITE_FRAMES):
+            if self.error is not None:
+                raise self.error
+            self.blocks.put(samples[:, start:start + WRITE_FRAMES].copy())
+
+    # Returns as soon as the end of the stream is queued; the file is complete after wait()
+    def close(self):
+        self.blocks.put(None)
+
+    def wait(self):
+        self.thread.join()
+        if self.error is not None:
+            raise RuntimeError('Could not encode ' + self.filename + ': ' + str(self.error)) from self.error
+
+# Fans every block out to one background encoder per format; files maps each format to its file
+class OutputWriter:
+    def __init__(self, base_filename, formats, sample_rate, channels=2):
+        self.encoders = []
+        self.files = {}
+        try:
+            for output_format in parse_formats(formats):
+                filename = base_filename + OUTPUT_FORMATS[output_format]['extension']
+                self.encoders.append(BackgroundEncoder(filename, output_format, sample_rate, channels))
+                self.files[output_format] = filename
+        except Exception:
+            self.close()
+            raise
+
+    def write(self, samples):
+        for encoder in self.encoders:
+            encoder.write(samples)
+
+    def close(self):
+        for encoder in self.encoders:
+            encoder.close()
+
+    def wait(self):
+        for encoder in self.encoders:
+            encoder.wait()
+
+def open_output(base_filename, formats, sample_rate, channels=2):
+    return OutputWriter(base_filename, formats, sample_rate, channels)
+
+# Outputs closed without waiting, by name, oldest first
+_pending = []
+
+def add_pending(name, outputs):
+    _pending.append((name, outputs))
+
+# Waits until at most keep songs are still being encoded (all of them by default) and returns
+# the names of those whose encoding failed. wait_for_pending(1) after each song lets a song
+# encode while the next one is generated.
+def wait_for_pending(keep=0):
+    failed = []
+    while len(_pending) > keep:
+        name, outputs = _pending.pop(0)
+        for output in outputs:
+            try:
+                output.wait()
+            except RuntimeError:
+                if name not in failed:
+                    failed.append(name)
+    return failed
@@ -0,0 +1,49 @@
+import numpy as np
+
+# Markov chain sampling with NumPy: transition matrices are arrays with one row of
+# probabilities per state, stored as cumulative distributions, and a whole part
+# (notes, durations and velocities) is drawn in one pass
+
+# NumPy generator seeded from a random.Random (or the random module), so songs stay reproducible
+def numpy_rng(rng):
+    return np.random.default_rng(rng.getrandbits(64))
+
+# Cumulative distribution of each row of a weight matrix
+# A row without any weight falls back to a uniform choice
+def transition_cdf(weights):
+    weights = np.asarray(weights, dtype=np.float64)
+    totals = weights.sum(axis=1, keepdims=True)
+    weights = np.where(totals > 0, weights, 1.0)
+    cdf = np.cumsum(weights, axis=1)
+    return cdf / cdf[:, -1:]
+
+# Indices of the states visited in `length` steps, starting from a random state
+def sample_chain(cdf, length, np_rng):
+    num_states = cdf.shape[0]
+    draws = np_rng.random(length)
+    if np.all(cdf == cdf[0]):
+        # Every row is the same distribution: the steps are independent draws
+        steps = np.searchsorted(cdf[0], draws, side='right')
+    else:
+        steps = np.empty(length, dtype=np.int64)
+        current = np_rng.integers(num_states)
+        for i in range(length):
+            current = np.searchsorted(cdf[current], draws[i], side='right')
+            steps[i] = current
+    return np.minimum(steps, num_states - 1)
+
+# Random note durations (in beats) that add up to exactly total_beats; the last one is cut to fit
+def sample_durations(total_beats, np_rng, durations=(1, 2)):
+    if total_beats <= 0:
+        return np.zeros(0, dtype=np.int64)
+    # Enough draws even if every duration is the shortest one
+    max_notes = -(-total_beats // min(durations))
+    note_durations = np_rng.choice(durations, size=max_notes)
+    ends = np.cumsum(note_durations)
+    count = int(np.searchsorted(ends, total_beats)) + 1
+    note_durations = note_durations[:count]
+    note_durations[-1] -= ends[count - 1] - total_beats
+    return note_durations
+
+def sample_velocities(count, np_rng, low=70, high=100):
+    return np_rng.integers(low, high + 1, size=count)
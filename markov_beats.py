@@ -1,17 +1,22 @@
 from midiutil import MIDIFile
 from music21 import scale, roman
 from pydub import AudioSegment
-from midi2audio import FluidSynth
 from pedalboard import Pedalboard, Compressor, Gain, Chorus, LadderFilter, Phaser, Delay, Reverb
 from pedalboard.io import AudioFile
 
 import json
+import renderers
+import tracing
+import workspace
+import encoders
+import numpy as np
 import random
 import os
 import time
+import uuid
 from datetime import datetime
 
-def generate_beat(tempo, time_signature, measures, name, beat_parts):
+def generate_beat(tempo, time_signature, measures, name, beat_parts, rng=random, tracer=None, directory=None):
     # Mapeamento MIDI completo para partes de bateria
     drum_mapping = {
         'kick': [35, 36],  # Notas MIDI para o bumbo
@@ -50,10 +55,10 @@ def generate_beat(tempo, time_signature, measures, name, beat_parts):
 
         while total_notes > 0:
             # Escolha uma nota MIDI aleatória para a parte da bateria
-            current_note = random.choice(drum_mapping[part])
+            current_note = rng.choice(drum_mapping[part])
 
             # Escolha uma duração aleatória para a nota
-            note_duration = random.choice([1, 2])
+            note_duration = rng.choice([1, 2])
             if note_duration > total_notes:
                 note_duration = total_notes
 
@@ -68,38 +73,40 @@ def generate_beat(tempo, time_signature, measures, name, beat_parts):
         for i in range(len(beats[part])):
             note = beats[part][i]
             note_duration = note_durations[part][i]
-            velocity = random.randint(70, 100)
+            velocity = rng.randint(70, 100)
             mf.addNote(track, 0, note, time, note_duration, velocity)
             time += note_duration
 
     print("\t\t\tBeats: ", beats)
 
-    # Salve cada arquivo MIDI
-    directory = name.split('-')[0]
+    # Salve cada arquivo MIDI (no workspace da batida, se houver)
+    if directory is None:
+        directory = name.split('-')[0]
     if not os.path.exists(directory):
         os.makedirs(directory)
 
     filenames = {}
-    for part, mf in mfs.items():
-        filename = os.path.join(directory, f"{name}-{part}.mid")
-        with open(filename, 'wb') as outf:
-            mf.writeFile(outf)
-        filenames[part] = filename
+    with tracing.span(tracer, 'midi_write'):
+        for part, mf in mfs.items():
+            filename = os.path.join(directory, f"{name}-{part}.mid")
+            with open(filename, 'wb') as outf:
+                mf.writeFile(outf)
+            filenames[part] = filename
 
     return beats, filenames, total_duration
 
-def create_effect(effect_class, parameters):
+def create_effect(effect_class, parameters, rng=random):
     # Unpack the parameters
     probability = parameters['probability']
     value_range = parameters['value_range']
     
-    if random.random() < probability:
-        kwargs = {param: random.uniform(value_range[param][0], value_range[param][1])
+    if rng.random() < probability:
+        kwargs = {param: rng.uniform(value_range[param][0], value_range[param][1])
                   for param in value_range}
         return effect_class(**kwargs)
     return None
 
-def generate_pedalboard(effect_params_file):
+def generate_pedalboard(effect_params_file, rng=random):
     # Load effect parameters from the JSON file
     with open(effect_params_file, 'r') as json_file:
         effect_params = json.load(json_file)
@@ -115,7 +122,7 @@ def generate_pedalboard(effect_params_file):
     ]
     
     # Create a new pedalboard with the specified effects
-    board = Pedalboard([effect for effect in (create_effect(effect_class, parameters)
+    board = Pedalboard([effect for effect in (create_effect(effect_class, parameters, rng)
                                           for effect_class, parameters in effects)
                     if effect is not None])
     return board
@@ -151,45 +158,45 @@ def pedalboard_info_json(board):
     return pedals_and_parameters
 
 
-def get_random_sound_font(directory_path):
-    sound_fonts = [f for f in os.listdir(directory_path) if f.endswith('.sf2')]
-    file_return = random.choice(sound_fonts)
+def get_random_sound_font(directory_path, rng=random):
+    sound_fonts = sorted(f for f in os.listdir(directory_path) if f.endswith('.sf2'))
+    file_return = rng.choice(sound_fonts)
     return os.path.join(directory_path, file_return)
 
-def generate_random_tempo():
+def generate_random_tempo(rng=random):
     # https://blog.musiio.com/2021/08/19/which-musical-tempos-are-people-streaming-the-most/
     tempo_ranges = [(0.0183, 60, 70), (0.0454, 70, 80), (0.1849, 80, 90), (0.3721, 90, 100),
                     (0.4817, 100, 110), (0.5747, 110, 120), (0.7048, 120, 130), (0.7917, 130, 140),
                     (0.8958, 140, 150), (0.9739, 150, 160), (1.0, 160, 170)]
-    dice = random.random()
+    dice = rng.random()
     for prob, min_tempo, max_tempo in tempo_ranges:
         if dice < prob:
-            return random.randint(min_tempo, max_tempo)
+            return rng.randint(min_tempo, max_tempo)
 
-def generate_random_time_signature():
+def generate_random_time_signature(rng=random):
     time_signature_ranges = [(0.6, '4/4'), (0.75, '3/4'), (0.90, '2/4'), (1.0, '6/8')]
-    dice = random.random()
+    dice = rng.random()
     for prob, time_signature in time_signature_ranges:
         if dice < prob:
             return time_signature  
 
-def generate_beat_elements():
+def generate_beat_elements(rng=random):
     all_parts_ranges = [(0.95, 'kick'), (0.85, 'snare'), (0.7, 'hihat'), 
                         (0.4, 'tom_low'), (0.4, 'tom_mid'), (0.4, 'tom_high'), 
                         (0.3, 'cymbal'), (0.3, 'ride'), (0.3, 'clap'), (0.2, 'perc')]
     selected_ranges = []
     # dice = random.random()
     for prob, element in all_parts_ranges:
-        dice = random.random()
+        dice = rng.random()
         if dice < prob:
             selected_ranges.append(element)
     return selected_ranges
     
 
-def generate_beat_size():
-    return random.choice([8, 16, 32])
+def generate_beat_size(rng=random):
+    return rng.choice([8, 16, 32])
 
-def get_beat_part_level(beat_part):
+def get_beat_part_level(beat_part, rng=random):
     part_ranges = [('kick', 0.5, 0.9), ('snare', 0.4, 0.8), ('hihat', 0.4, 0.8),
                    ('tom_high', 0.3, 0.8), ('tom_mid', 0.3, 0.8), ('tom_low', 0.3, 0.8),
                    ('cymbal', 0.3, 0.8), ('ride', 0.5, 0.9), ('clap', 0.4, 0.8), 
@@ -197,9 +204,9 @@ def get_beat_part_level(beat_part):
     
     for part, range_max, range_min in part_ranges:
         if part == beat_part:
-            return random.uniform(range_min, range_max)
+            return rng.uniform(range_min, range_max)
         
-def get_beat_part_pan(beat_part):
+def get_beat_part_pan(beat_part, rng=random):
     part_ranges = [('kick', 0.0, 0.0), ('snare', -0.1, 0.1), ('hihat', -0.2, 0.2),
                    ('tom_high', -0.5, -0.2), ('tom_mid', -0.1, 0.3), ('tom_low', 0.3, 0.8),
                    ('cymbal', -0.8, -0.3), ('ride', 0.3, 0.9), ('clap', -0.1, 0.1), 
@@ -207,13 +214,16 @@ def get_beat_part_pan(beat_part):
     
     for part, range_max, range_min in part_ranges:
         if part == beat_part:
-            return random.uniform(range_min, range_max)
+            return rng.uniform(range_min, range_max)
 
 
-def mix_and_save(beat_parts, beat_name, beat_duration):
+def mix_and_save(beat_parts, beat_name, beat_duration, renderer=None, rng=random, tracer=None, scratch_dir=None, output_formats=('wav',),
+                 wait_for_encoders=True):
     #TODO: configure soundfont directory 
     #TODO: levels and pan in a json file
-    beat_soundfont = get_random_sound_font(str(os.path.join('sf','beat')))
+    beat_soundfont = get_random_sound_font(str(os.path.join('sf','beat')), rng)
+    if renderer is None:
+        renderer = renderers.get_renderer()
     print("Beat soundfont: " + beat_soundfont)
     print("Mixing song parts...")    
     beat_part_boards = {}
@@ -224,61 +234,124 @@ def mix_and_save(beat_parts, beat_name, beat_duration):
     
     for beat_part in beat_parts:
         beat_part_wav = beat_name + "-" + beat_part + ".wav"
-        beat_part_wav = os.path.join(beat_name, beat_part_wav)
-        FluidSynth(beat_soundfont).midi_to_audio(beat_parts[beat_part], beat_part_wav)
-        board = generate_pedalboard('beat_fx.json')
+        # Rendered parts are intermediates: they go to the scratch directory if there is one
+        beat_part_wav = os.path.join(scratch_dir if scratch_dir is not None else beat_name, beat_part_wav)
+        with tracing.span(tracer, 'render', layer=beat_part):
+            renderer.render_to_file(beat_parts[beat_part], beat_soundfont, beat_part_wav)
+        board = generate_pedalboard('beat_fx.json', rng)
         beat_part_boards[beat_part] = board
-        beat_part_render = AudioSegment.from_wav(apply_fx_to_layer(beat_part_wav, board))
-        beat_part_levels[beat_part] = get_beat_part_level(beat_part)
-        beat_part_render.volume = float(beat_part_levels[beat_part])
-        beat_part_pan[beat_part] = get_beat_part_pan(beat_part)
-        beat_part_render.pan(float(beat_part_pan[beat_part]))
-        mix = mix.overlay(beat_part_render)
-
-    mix_file = beat_name + '.wav'
-    mix_file = os.path.join(beat_name, mix_file) 
-    mix.export(mix_file, format='wav')
-    print("Beat saved as: " + mix_file)
-    return mix_file, beat_soundfont, beat_part_boards, beat_part_levels, beat_part_pan
-
-def create_random_beat(name):
+        with tracing.span(tracer, 'fx', layer=beat_part):
+            beat_part_render = AudioSegment.from_wav(apply_fx_to_layer(beat_part_wav, board))
+        with tracing.span(tracer, 'mix', layer=beat_part):
+            beat_part_levels[beat_part] = get_beat_part_level(beat_part, rng)
+            beat_part_render.volume = float(beat_part_levels[beat_part])
+            beat_part_pan[beat_part] = get_beat_part_pan(beat_part, rng)
+            beat_part_render.pan(float(beat_part_pan[beat_part]))
+            mix = mix.overlay(beat_part_render)
+
+    # WAV is exported by pydub as before; the other formats are encoded from the mix samples,
+    # each on its own thread (see encoders.py). Without wait_for_encoders they are still being
+    # encoded when this returns, and are waited for with encoders.wait_for_pending
+    output_formats = encoders.parse_formats(output_formats)
+    mix_files = {}
+    with tracing.span(tracer, 'export'):
+        compressed_formats = [output_format for output_format in output_formats if output_format != 'wav']
+        if compressed_formats:
+            output = encoders.open_output(os.path.join(beat_name, beat_name), compressed_formats, mix.frame_rate, mix.channels)
+            try:
+                output.write(segment_samples(mix))
+            finally:
+                output.close()
+        if 'wav' in output_formats:
+            mix_file = os.path.join(beat_name, beat_name + '.wav')
+            mix.export(mix_file, format='wav')
+            mix_files['wav'] = mix_file
+        if compressed_formats:
+            if wait_for_encoders:
+                output.wait()
+            else:
+                encoders.add_pending(beat_name, [output])
+            mix_files.update(output.files)
+    mix_files = {output_format: mix_files[output_format] for output_format in output_formats}
+    for mix_file in mix_files.values():
+        print("Beat saved as: " + mix_file)
+    return mix_files, beat_soundfont, beat_part_boards, beat_part_levels, beat_part_pan
+
+# Samples of a pydub segment as float32 (channels, frames)
+def segment_samples(segment):
+    samples = np.array(segment.get_array_of_samples(), dtype=np.float32).reshape(-1, segment.channels).T
+    return samples / float(2 ** (8 * segment.sample_width - 1))
+
+# All random choices come from one random.Random seeded with `seed`, so a beat can be regenerated
+# With resources, the memory, CPU, subprocesses and bytes written of every stage are recorded too.
+# MIDI files and rendered parts are written to a scratch workspace (see workspace.py), removed
+# once the beat is mixed unless keep_intermediates is set. The beat is saved in each of
+# output_formats ('wav', 'flac', 'ogg', 'opus'); with wait_for_encoders=False it returns while
+# they are still encoding (see encoders.wait_for_pending).
+def create_random_beat(name, renderer=None, seed=None, resources=False, scratch_dir=None, keep_intermediates=False,
+                       output_formats=('wav',), wait_for_encoders=True):
     start_time = time.time()
-    tempo = generate_random_tempo()
-    time_signature = generate_random_time_signature()
-    measures = generate_beat_size()
-    beat_elements = generate_beat_elements()
-    
-    beat_info = {}
-    beat_info['name'] = name
-    beat_info['tempo'] = tempo
-    beat_info['time_signature'] = time_signature
-    beat_info['measures'] = measures
-    beat_info['elements'] = beat_elements
+    tracer = tracing.Tracer(resources)
+    beat_span = tracer.begin('beat')
+    try:
+        if seed is None:
+            seed = random.randrange(2**32)
+        rng = random.Random(seed)
+        tempo = generate_random_tempo(rng)
+        time_signature = generate_random_time_signature(rng)
+        measures = generate_beat_size(rng)
+        beat_elements = generate_beat_elements(rng)
     
-    beat_structure, midi_filenames, duration = generate_beat(tempo, time_signature, measures, name, beat_elements)
+        beat_info = {}
+        beat_info['seed'] = seed
+        beat_info['name'] = name
+        beat_info['tempo'] = tempo
+        beat_info['time_signature'] = time_signature
+        beat_info['measures'] = measures
+        beat_info['elements'] = beat_elements
     
-    beat_info['duration'] = duration    
-    beat_info['structure'] = beat_structure
-    # beat_info['midi_files'] = midi_filenames
-
-    print("Beat:", beat_structure)
-    print("Filenames:", midi_filenames)
-
-    mix_file, beat_soundfont, beat_part_boards, levels, panning = mix_and_save(midi_filenames, name, duration)
+        os.makedirs(name, exist_ok=True)
+        with workspace.Workspace(name, scratch_dir, keep_intermediates) as beat_workspace:
+            with tracer.span('generate'):
+                beat_structure, midi_filenames, duration = generate_beat(tempo, time_signature, measures, name, beat_elements, rng, tracer,
+                                                                         beat_workspace.path)
+
+            beat_info['duration'] = duration
+            beat_info['structure'] = beat_structure
+            # beat_info['midi_files'] = midi_filenames
+
+            print("Beat:", beat_structure)
+            print("Filenames:", midi_filenames)
+
+            with tracer.span('mix_and_save'):
+                mix_files, beat_soundfont, beat_part_boards, levels, panning = mix_and_save(midi_filenames, name, duration, renderer, rng, tracer,
+                                                                                            beat_workspace.path, output_formats, wait_for_encoders)
+        if keep_intermediates:
+            beat_info['intermediates'] = beat_workspace.path
     
-    beat_info['soundfont'] = beat_soundfont
+        beat_info['soundfont'] = beat_soundfont
     
-    beat_info['levels'] = levels
+        beat_info['levels'] = levels
     
-    beat_info['panning'] = panning
+        beat_info['panning'] = panning
     
-    beat_part_boards_js = {}
+        beat_part_boards_js = {}
     
-    for part in beat_part_boards:
-        beat_part_boards_js[part] = pedalboard_info_json(beat_part_boards[part])    
+        for part in beat_part_boards:
+            beat_part_boards_js[part] = pedalboard_info_json(beat_part_boards[part])    
     
-    beat_info['fx'] = beat_part_boards_js
-    beat_info['file_name'] = mix_file
+        beat_info['fx'] = beat_part_boards_js
+        mix_file = next(iter(mix_files.values()))
+        beat_info['file_name'] = mix_file
+        beat_info['files'] = mix_files
+        tracer.end(beat_span)
+    finally:
+        # Stops tracemalloc (with resources) even if the generation fails
+        tracer.close()
+    # Seconds (and resources) spent in every stage, in total and by beat element
+    beat_info['timings'] = {'stages': tracer.totals(), 'layers': tracer.totals('layer')}
+    if resources:
+        beat_info['resources'] = tracer.resources_of('beat')
     
     json_file = os.path.join(name, name + '.json')
     
@@ -296,10 +369,15 @@ def create_random_beat(name):
 
 
 
-# Example usage
-
-for i in range(100):
+# Unique beat name: timestamp plus a random suffix, so beats finished in the same second don't collide
+def generate_beat_id():
     now = datetime.now()
-    beat_gen_name = now.strftime("%Y%m%d%H%M%S")
-    create_random_beat(beat_gen_name)
+    return now.strftime("%Y%m%d%H%M%S") + "_" + uuid.uuid4().hex[:8]
+
+# Example usage (see batch.py to generate beats in parallel)
+
+if __name__ == '__main__':
+    for i in range(100):
+        beat_gen_name = generate_beat_id()
+        create_random_beat(beat_gen_name)
 
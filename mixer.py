@@ -0,0 +1,39 @@
+import math
+import numpy as np
+
+# Vectorized mixing on float32 arrays shaped (channels, frames), the layout used by
+# pedalboard and the renderers. Each part is mixed into its own buffer and appended to
+# the song file as soon as it is finished, so only one part is held in memory at a time.
+
+def duration_to_frames(seconds, sample_rate):
+    return int(round(seconds * sample_rate))
+
+# Stereo gains for a pan value between -1.0 (left) and 1.0 (right), using the same law
+# as pydub's AudioSegment.pan: centred layers are left untouched, and fully panned
+# layers are 3 dB louder on one side (pydub halves the boost in dB) and silent on the other
+def pan_gains(pan):
+    reduce = 2 - 2 ** abs(pan)
+    boost = math.sqrt(2 ** abs(pan))
+    if pan > 0:
+        return reduce, boost
+    return boost, reduce
+
+def to_stereo(samples):
+    if samples.shape[0] == 1:
+        return np.repeat(samples, 2, axis=0)
+    return samples[:2]
+
+def create_mix_buffer(frames):
+    return np.zeros((2, frames), dtype=np.float32)
+
+# Add a layer to a mix (usually a slice of the song buffer) with its volume and pan
+# Like AudioSegment.overlay, the layer is cut at the end of the mix
+def mix_layer(mix, samples, volume, pan):
+    samples = to_stereo(samples)
+    frames = min(mix.shape[1], samples.shape[1])
+    gains = np.array(pan_gains(pan), dtype=np.float32)[:, np.newaxis] * np.float32(volume)
+    mix[:, :frames] += samples[:, :frames] * gains
+    return mix
+
+def limit(samples):
+    return np.clip(samples, -1.0, 1.0, out=samples)
@@ -1,7 +1,4 @@
 from midiutil import MIDIFile
-from music21 import *
-from pydub import AudioSegment
-from midi2audio import FluidSynth
 from datetime import datetime
 from pedalboard import Pedalboard, Compressor, Gain, Chorus, LadderFilter, Phaser, Delay, Reverb
 from pedalboard.io import AudioFile
@@ -9,10 +6,35 @@ import time
 import json
 import random
 import os
-import glob
+import numpy as np
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 import musicality_score 
+import renderers
+import mixer
+import patterns
+import pitch_tables
+import markov
+import tracing
+import timeline
+import workspace
+import encoders
+
+# MIDI files of a song part are saved in the directory of `name` when it is a path (the song's
+# workspace), otherwise in a directory named after the song
+def write_midi(mf, name, layer, tracer=None):
+    directory, name = os.path.split(name)
+    if not directory:
+        directory = name.split('-')[0]
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    filename = os.path.join(directory, name + "-" + layer + ".mid")
+    with tracing.span(tracer, 'midi_write'):
+        with open(filename, 'wb') as outf:
+            mf.writeFile(outf)
+    return filename
 
-def generate_chord_progression(key, tempo, time_signature, measures, name, part, pattern_file):
+def generate_chord_progression(key, tempo, time_signature, measures, name, part, pattern_file, rng=random, tracer=None):
     # Create a MIDI file with one track
     mf = MIDIFile(1)
     track = 0
@@ -22,44 +44,29 @@ def generate_chord_progression(key, tempo, time_signature, measures, name, part,
     
     beats_per_measure = int(time_signature.split('/')[0])
 
-    # Read chord patterns from a text file
-    chord_patterns = {}
-    with open(pattern_file, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if line:
-                part_name, pattern = line.split(':')
-                chord_patterns.setdefault(part_name, []).append(pattern.split(','))
-
-    # Shuffle the list of chord patterns
-    random.shuffle(chord_patterns.get(part, chord_patterns.get(part, [['I', 'IV', 'V', 'vi']])))
+    # Chord patterns from the text file, parsed once per process
+    chord_patterns = patterns.load_chord_patterns(pattern_file)
+
     # Choose a random chord pattern based on the part of the song
-    chord_pattern = random.choice(chord_patterns.get(part, [['I', 'IV', 'V', 'vi']]))
+    chord_pattern = list(patterns.choose_pattern(chord_patterns, part, ['I', 'IV', 'V', 'vi'], rng))
 
-    chord_progression = []
-    for chord_symbol in chord_pattern:
-        chord = roman.RomanNumeral(chord_symbol, key)
-        chord_progression.append(chord)
+    # MIDI pitches of each chord in the song key
+    chord_progression = [pitch_tables.chord_pitches(key, chord_symbol) for chord_symbol in chord_pattern]
 
     chord_duration = beats_per_measure / len(chord_pattern)
     for i in range(measures * len(chord_pattern)):
         chord = chord_progression[i % len(chord_progression)]
-        for note in chord.pitches:
-            mf.addNote(track, 0, note.midi, time, chord_duration, 100)
+        for note in chord:
+            mf.addNote(track, 0, note, time, chord_duration, 100)
         time += chord_duration
 
     # Save MIDI file
-    directory = name.split('-')[0]
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-    filename = os.path.join(directory, name + "-chord_progression.mid")
-    with open(filename, 'wb') as outf:
-        mf.writeFile(outf)
+    filename = write_midi(mf, name, "chord_progression", tracer)
 
     print("\t\t\tChord pattern: " + str(chord_pattern))
     return chord_pattern, filename
 
-def generate_melody(key, tempo, time_signature, measures, name, part, chord_progression):
+def generate_melody(key, tempo, time_signature, measures, name, part, chord_progression, rng=random, tracer=None):
     # Create a MIDI file with one track
     mf = MIDIFile(1)
     track = 0
@@ -70,85 +77,46 @@ def generate_melody(key, tempo, time_signature, measures, name, part, chord_prog
     # Determine the number of beats per measure based on the time signature
     beats_per_measure = int(time_signature.split('/')[0])
 
-    # Create scale based on key
-    if key[-1] == 'm':
-        scale_obj = scale.MinorScale(key[:-1])
-    else:
-        scale_obj = scale.MajorScale(key)
-
-    # Create chord progression based on key and chord progression input
-    chords = []
-    for chord_symbol in chord_progression:
-        chord_obj = roman.RomanNumeral(chord_symbol, key)
-        chord_obj.key = key
-        chords.append(chord_obj)
+    # MIDI pitches of each chord of the progression in the song key
+    chords = [pitch_tables.chord_pitches(key, chord_symbol) for chord_symbol in chord_progression]
 
     # Determine which notes to use based on song part and chord progression
     if part == 'intro':
-        notes_to_use = chords[0].pitches
+        notes_to_use = list(chords[0])
     elif part == 'outro':
-        notes_to_use = chords[-1].pitches
+        notes_to_use = list(chords[-1])
     else:
         notes_to_use = []
         for chord in chords:
-            notes_to_use.extend(chord.pitches)
+            notes_to_use.extend(chord)
 
-    # Define the Markov chain transition matrix
+    # Define the Markov chain transition matrix over the distinct notes to use
     # This matrix defines the probabilities of transitioning from one note to another
-    transition_matrix = {}
-    for note in notes_to_use:
-        transition_matrix[note.midi] = {}
-        for next_note in notes_to_use:
-            if next_note in chord_obj.pitches:
-                transition_matrix[note.midi][next_note.midi] = 1 / len(notes_to_use)
-            else:
-                transition_matrix[note.midi][next_note.midi] = 0
-
-    # Generate a random melody using a Markov chain
-    melody = []
-    note_durations = []
-    total_notes = measures * beats_per_measure
-
-    # Choose the initial note randomly
-    current_note = random.choice(list(transition_matrix.keys()))
-
-    while total_notes > 0:
-        # Choose the next note based on the Markov chain transition probabilities
-        current_note = random.choices(
-            population=list(transition_matrix[current_note].keys()),
-            weights=list(transition_matrix[current_note].values())
-        )[0]
-
-        # Choose a random duration for the note
-        note_duration = random.choice([1, 2])
-        if note_duration > total_notes:
-            note_duration = total_notes
-
-        # Add the note to the melody
-        melody.append(current_note)
-        note_durations.append(note_duration)
-        total_notes -= note_duration
+    # Only notes of the last chord of the progression can be reached
+    states = np.array(list(dict.fromkeys(notes_to_use)))
+    last_chord = chords[-1]
+    reachable = np.isin(states, last_chord)
+    transition_matrix = np.tile(reachable, (len(states), 1))
+    transition_cdf = markov.transition_cdf(transition_matrix)
+
+    # Generate a random melody using a Markov chain, drawing every note, duration and velocity at once
+    np_rng = markov.numpy_rng(rng)
+    note_durations = markov.sample_durations(measures * beats_per_measure, np_rng)
+    melody = states[markov.sample_chain(transition_cdf, len(note_durations), np_rng)].tolist()
+    velocities = markov.sample_velocities(len(melody), np_rng)
 
     # Add notes to MIDI file
-    for i in range(len(melody)):
-        note = melody[i]
-        note_duration = note_durations[i]
-        velocity = random.randint(70, 100)
+    for note, note_duration, velocity in zip(melody, note_durations.tolist(), velocities.tolist()):
         mf.addNote(track, 0, note, time, note_duration, velocity)
         time += note_duration
 
     print("\t\t\tMelody: " + str(melody))
 
     # Save MIDI file
-    directory = name.split('-')[0]
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-    filename = os.path.join(directory, name + "-melody.mid")
-    with open(filename, 'wb') as outf:
-        mf.writeFile(outf)
+    filename = write_midi(mf, name, "melody", tracer)
     return melody, filename
 
-def generate_bassline(key, tempo, time_signature, measures, name, part, chord_progression, melody):
+def generate_bassline(key, tempo, time_signature, measures, name, part, chord_progression, melody, rng=random, tracer=None):
     # Create a MIDI file with one track
     mf = MIDIFile(1)
     track = 0
@@ -159,96 +127,48 @@ def generate_bassline(key, tempo, time_signature, measures, name, part, chord_pr
     # Determine the number of beats per measure based on the time signature
     beats_per_measure = int(time_signature.split('/')[0])
 
-    # Create scale based on key
-    if key[-1] == 'm':
-        scale_obj = scale.MinorScale(key[:-1])
-    else:
-        scale_obj = scale.MajorScale(key)
-
-    # Create chord progression based on key and chord progression input
-    chords = []
-    for chord_symbol in chord_progression:
-        chord_obj = roman.RomanNumeral(chord_symbol, key)
-        chord_obj.key = key
-        chords.append(chord_obj)
+    # MIDI pitches of each chord of the progression in the song key
+    chords = [pitch_tables.chord_pitches(key, chord_symbol) for chord_symbol in chord_progression]
 
     # Determine which notes to use based on song part and chord progression
     if part == 'intro':
-        notes_to_use = [chords[0].pitches[0]]
-    #    notes_to_use = [chords[0].root]
+        notes_to_use = [chords[0][0]]
     elif part == 'outro':
-        notes_to_use = [chords[-1].pitches[0]]
-    #    notes_to_use = [chords[-1].root]
+        notes_to_use = [chords[-1][0]]
     else:
-    #    notes_to_use = [chord.root for chord in chords]
-        notes_to_use = [chord.pitches[0] for chord in chords]
+        notes_to_use = [chord[0] for chord in chords]
 
-    # Define the Markov chain transition matrix
+    # Define the Markov chain transition matrix over the distinct notes to use
     # This matrix defines the probabilities of transitioning from one note to another
-    transition_matrix = {}
-    for note in notes_to_use:
-        transition_matrix[note.midi] = {}
-        for next_note in notes_to_use:
-            transition_matrix[note.midi][next_note.midi] = 1 / len(notes_to_use)
-
-    # Generate a random bassline using a Markov chain
-    bassline = []
-    note_durations = []
-    total_notes = measures * beats_per_measure
-
-    # Choose the initial note randomly
-    current_note = random.choice(list(transition_matrix.keys()))
-
-    while total_notes > 0:
-        # Choose the next note based on the Markov chain transition probabilities
-        current_note = random.choices(
-            population=list(transition_matrix[current_note].keys()),
-            weights=list(transition_matrix[current_note].values())
-        )[0]
-
-        # Choose a random duration for the note
-        note_duration = random.choice([1, 2])
-        if note_duration > total_notes:
-            note_duration = total_notes
-
-        # Add the note to the bassline
-        bassline.append(current_note)
-        note_durations.append(note_duration)
-
-        total_notes -= note_duration
-
-    # Make sure the bassline follows the melody
-    for i in range(len(bassline)):
-        if i < len(melody):
-            if bassline[i] != melody[i]:
-                if random.random() < 0.5:
-                    bassline[i] = melody[i]
+    states = np.array(list(dict.fromkeys(notes_to_use)))
+    transition_matrix = np.ones((len(states), len(states)))
+    transition_cdf = markov.transition_cdf(transition_matrix)
+
+    # Generate a random bassline using a Markov chain, drawing every note, duration and velocity at once
+    np_rng = markov.numpy_rng(rng)
+    note_durations = markov.sample_durations(measures * beats_per_measure, np_rng)
+    bassline = states[markov.sample_chain(transition_cdf, len(note_durations), np_rng)]
+
+    # Make sure the bassline follows the melody: where they differ, take the melody note half of the time
+    follow = min(len(bassline), len(melody))
+    melody_notes = np.array(melody[:follow], dtype=bassline.dtype)
+    take_melody = (bassline[:follow] != melody_notes) & (np_rng.random(follow) < 0.5)
+    bassline[:follow][take_melody] = melody_notes[take_melody]
+    bassline = bassline.tolist()
+    velocities = markov.sample_velocities(len(bassline), np_rng)
 
     print("\t\t\tBassline: " + str(bassline))
     # Add notes to MIDI file
-    for i in range(len(bassline)):
-        note = bassline[i]
-        note_duration = note_durations[i]
-        velocity = random.randint(70, 100)
-        
+    for note, note_duration, velocity in zip(bassline, note_durations.tolist(), velocities.tolist()):
         # Set the octave of the note to 2 (bass range)
-        note_obj = pitch.Pitch()
-        note_obj.midi = note
-        note_obj.octave = 2
-        
-        mf.addNote(track, 0, note_obj.midi, time, note_duration, velocity)
+        mf.addNote(track, 0, pitch_tables.set_octave(note, 2), time, note_duration, velocity)
         time += note_duration
 
     # Save MIDI file
-    directory = name.split('-')[0]
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-    filename = os.path.join(directory, name + "-bassline.mid")
-    with open(filename, 'wb') as outf:
-        mf.writeFile(outf)
+    filename = write_midi(mf, name, "bassline", tracer)
     return filename
 
-def generate_beat(tempo,time_signature,measures,name,part,filename):
+def generate_beat(tempo,time_signature,measures,name,part,filename,rng=random,tracer=None):
     # Create a MIDI file with one track
     mf = MIDIFile(1)
     track = 0 
@@ -264,26 +184,13 @@ def generate_beat(tempo,time_signature,measures,name,part,filename):
     snare = 38 
     hihat = 42 
 
-    # Read beat patterns from file
-    beat_patterns = {}
-    with open(filename,'r') as f:
-        for line in f:
-            line = line.strip()
-            if line:
-                parts = line.split(':')
-                song_part = parts[0].strip()
-                beat_pattern = [int(x) for x in parts[1].split(',')]
-                if song_part not in beat_patterns:
-                    beat_patterns[song_part] = []
-                beat_patterns[song_part].append(beat_pattern)
+    # Beat patterns from file, parsed once per process
+    beat_patterns = patterns.load_beat_patterns(filename)
     # Create a beat
     beat = []
 
     # Choose a random beat pattern based on song part and available patterns from file
-    if part in beat_patterns:
-        beat_pattern = random.choice(beat_patterns[part])
-    else:
-        beat_pattern = [kick, 0, snare, 0]
+    beat_pattern = patterns.choose_pattern(beat_patterns, part, [kick, 0, snare, 0], rng)
     	
     # Repeat the pattern for the number of measures - 1    
     for i in range(measures-1):
@@ -291,11 +198,7 @@ def generate_beat(tempo,time_signature,measures,name,part,filename):
 
     # Choose a random beat roll pattern based on song part and available patterns from file
     roll_part = part + "_roll"
-    
-    if roll_part in beat_patterns:
-        roll_pattern = random.choice(beat_patterns[roll_part])
-    else:
-        roll_pattern = [kick , snare, snare, snare]
+    roll_pattern = patterns.choose_pattern(beat_patterns, roll_part, [kick , snare, snare, snare], rng)
     
     beat.extend(roll_pattern)
     
@@ -305,19 +208,17 @@ def generate_beat(tempo,time_signature,measures,name,part,filename):
         if drum_sound != 0:
             mf.addNote(track ,9 ,drum_sound ,time ,1.0/beats_per_measure ,100)
         time +=1.0/beats_per_measure
+    # Duration of the beat in seconds, used as the length of the part
+    duration = time * 60 / tempo
 
     # Save MIDI file
-    directory = name.split('-')[0]
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-    filename = os.path.join(directory, name + "-beat.mid")
-    with open(filename, 'wb') as outf:
-        mf.writeFile(outf)
+    filename = write_midi(mf, name, "beat", tracer)
     
     print("\t\t\tBeat: " + str(beat))
-    return filename
+    return filename, duration
 
-def generate_song_parts(key, tempo, time_signature, song_measures, name, chord_pat_file, beat_pat_file):
+def generate_song_parts(key, tempo, time_signature, song_measures, name, chord_pat_file, beat_pat_file, rng=random, tracer=None,
+                        directory=None):
     print("Generating song parts for: " + name)
     print("\tKey: " + key)
     print("\tTempo: " + str(tempo))
@@ -326,16 +227,24 @@ def generate_song_parts(key, tempo, time_signature, song_measures, name, chord_p
     bass_filename = {}
     melo_filename = {}
     beat_filename = {}
+    part_durations = {}
     for part, measures in song_measures.items():
         print("\t\tGenerating part: " + part + " (" + str(measures) + " measures)")
         name_part = name + "-" + part
-        chord_progression, harm_filename[part] = generate_chord_progression(key, tempo, time_signature, measures, name_part, part, chord_pat_file)
-        melody, melo_filename[part] = generate_melody(key, tempo, time_signature, measures, name_part, part, chord_progression)
-        bass_filename[part] = generate_bassline(key, tempo, time_signature, measures, name_part, part, chord_progression, melody)
-        beat_filename[part] = generate_beat(tempo, time_signature, measures, name_part, part, beat_pat_file)
-    return harm_filename, bass_filename, melo_filename, beat_filename
-
-def generate_song_arrangement() :
+        if directory is not None:
+            name_part = os.path.join(directory, name_part)
+        with tracing.span(tracer, 'generate_part', part=part):
+            with tracing.span(tracer, 'generate', part=part, layer='harmony'):
+                chord_progression, harm_filename[part] = generate_chord_progression(key, tempo, time_signature, measures, name_part, part, chord_pat_file, rng, tracer)
+            with tracing.span(tracer, 'generate', part=part, layer='melody'):
+                melody, melo_filename[part] = generate_melody(key, tempo, time_signature, measures, name_part, part, chord_progression, rng, tracer)
+            with tracing.span(tracer, 'generate', part=part, layer='bassline'):
+                bass_filename[part] = generate_bassline(key, tempo, time_signature, measures, name_part, part, chord_progression, melody, rng, tracer)
+            with tracing.span(tracer, 'generate', part=part, layer='beat'):
+                beat_filename[part], part_durations[part] = generate_beat(tempo, time_signature, measures, name_part, part, beat_pat_file, rng, tracer)
+    return harm_filename, bass_filename, melo_filename, beat_filename, part_durations
+
+def generate_song_arrangement(rng=random) :
     common_structures = [
         ['intro', 'verse', 'chorus', 'verse', 'chorus', 'bridge', 'chorus', 'outro'],
         ['verse', 'chorus', 'verse', 'chorus', 'bridge', 'chorus'],
@@ -361,8 +270,9 @@ def generate_song_arrangement() :
         ['intro', 'verse', 'bridge', 'chorus', 'verse', 'chorus', 'outro'],
         ['intro', 'verse', 'chorus', 'verse', 'bridge', 'chorus', 'outro']
     ]
-    result = random.choice(common_structures)
-    unique_elements = list(set(result))
+    result = rng.choice(common_structures)
+    # Keep the order of first appearance so the unique parts are the same on every run
+    unique_elements = list(dict.fromkeys(result))
     return unique_elements, result
 
 def read_instrument_probabilities(file_path):
@@ -370,9 +280,9 @@ def read_instrument_probabilities(file_path):
         inst_probabilities = json.load(f)
     return inst_probabilities  
 
-def get_random_sound_font(directory_path):
-    sound_fonts = [f for f in os.listdir(directory_path) if f.endswith('.sf2')]
-    file_return = random.choice(sound_fonts)
+def get_random_sound_font(directory_path, rng=random):
+    sound_fonts = sorted(f for f in os.listdir(directory_path) if f.endswith('.sf2'))
+    file_return = rng.choice(sound_fonts)
     return os.path.join(directory_path, file_return)
 
 def get_levels(file_path):
@@ -380,18 +290,18 @@ def get_levels(file_path):
         levels = json.load(f)
     return levels  
 
-def create_effect(effect_class, parameters):
+def create_effect(effect_class, parameters, rng=random):
     # Unpack the parameters
     probability = parameters['probability']
     value_range = parameters['value_range']
     
-    if random.random() < probability:
-        kwargs = {param: random.uniform(value_range[param][0], value_range[param][1])
+    if rng.random() < probability:
+        kwargs = {param: rng.uniform(value_range[param][0], value_range[param][1])
                   for param in value_range}
         return effect_class(**kwargs)
     return None
 
-def generate_pedalboard(effect_params_file):
+def generate_pedalboard(effect_params_file, rng=random):
     # Load effect parameters from the JSON file
     with open(effect_params_file, 'r') as json_file:
         effect_params = json.load(json_file)
@@ -407,22 +317,59 @@ def generate_pedalboard(effect_params_file):
     ]
     
     # Create a new pedalboard with the specified effects
-    board = Pedalboard([effect for effect in (create_effect(effect_class, parameters)
+    board = Pedalboard([effect for effect in (create_effect(effect_class, parameters, rng)
                                           for effect_class, parameters in effects)
                     if effect is not None])
     return board
     
-def apply_fx_to_layer(wav_file, board):
-    # Apply the pedalboard effects to the input file        
+def apply_fx_to_layer(wav_file, board, block_size=None):
+    # Apply the pedalboard effects to the input file, block_size frames at a time (default: 1 second)
     with AudioFile(wav_file) as af:
+        if block_size is None:
+            block_size = int(af.samplerate)
         with AudioFile(wav_file+'_fx.wav', 'w', af.samplerate, af.num_channels) as of:        
             while af.tell() < af.frames:
-                chunk = af.read(af.samplerate)
+                chunk = af.read(block_size)
                 effected = board(chunk, af.samplerate, reset=False)
                 of.write(effected)
               
     return wav_file+'_fx.wav'
 
+# Apply the pedalboard effects to audio already in memory, in the same blocks as apply_fx_to_layer.
+# The result is clipped to [-1, 1], as apply_fx_to_layer's 16-bit file clips it, so a song
+# mixes the same in memory and on disk.
+def apply_fx_to_buffer(samples, sample_rate, board, block_size=None):
+    if block_size is None:
+        block_size = sample_rate
+    chunks = []
+    for start in range(0, samples.shape[1], block_size):
+        chunks.append(board(samples[:, start:start + block_size], sample_rate, reset=False))
+    if not chunks:
+        return samples
+    return mixer.limit(np.concatenate(chunks, axis=1))
+
+# Render a layer's MIDI file with the given soundfont
+# In memory, the samples are returned (a renderer that needs a temporary file puts it next to
+# wav_file, in the scratch directory); otherwise the audio is written to wav_file
+def render_layer(midi_file, soundfont, wav_file, renderer, in_memory=False):
+    if in_memory:
+        return renderer.render(midi_file, soundfont, os.path.dirname(wav_file) or None)
+    return renderer.render_to_file(midi_file, soundfont, wav_file)
+
+# Apply a layer's (or a whole layer timeline's) effects to its rendered audio, keeping the
+# result where it is: samples in memory, or a WAV file that is read back when it is mixed
+def process_layer(rendered, board, sample_rate, in_memory=False, block_size=None):
+    if in_memory:
+        return apply_fx_to_buffer(rendered, sample_rate, board, block_size)
+    return apply_fx_to_layer(rendered, board, block_size)
+
+# Samples of a processed layer (see process_layer)
+def load_layer(processed):
+    if isinstance(processed, str):
+        samples, _ = renderers.read_audio(processed)
+        return samples
+    return processed
+
 def pedalboard_info_json(board):
     pedals_and_parameters = []
     for pedal in board:
@@ -442,13 +389,14 @@ def pedalboard_info_json(board):
         pedals_and_parameters.append(pedal_info)    
     return pedals_and_parameters
     
-# Mix song parts and save the result to WAV files
-def mix_and_save(harm_filename, bass_filename, melo_filename, beat_filename, name):
+# Mix song parts and save the result in the output formats
+def mix_and_save(harm_filename, bass_filename, melo_filename, beat_filename, part_durations, name, renderer=None, in_memory=False, stems=False, rng=random, fx_workers=4, fx_block_size=None,
+                 analysis=None, tracer=None, layer_timelines=False,
+                 scratch_dir=None, output_formats=('wav',), wait_for_encoders=True):
     # TODO: only render and mix the parts that are used in the song arrangement
-    song_unique_parts, song_arrangement = generate_song_arrangement()
+    song_unique_parts, song_arrangement = generate_song_arrangement(rng)
     print("Song arrangement: "+ str(song_arrangement) + "\n")
     number_of_parts = len(song_arrangement)
-    song_parts = []
     part_layers = {}
     part_layers['intro'] = []
     part_layers['verse'] = []
@@ -457,12 +405,14 @@ def mix_and_save(harm_filename, bass_filename, melo_filename, beat_filename, nam
     part_layers['outro'] = []
     part_counter = 0
     soundfonts = {}
+    if renderer is None:
+        renderer = renderers.get_renderer()
     pedalboards = {}
     #TODO: configure soundfont directory 
-    beat_soundfont = get_random_sound_font(str(os.path.join('sf','beat')))
-    melody_soundfont = get_random_sound_font(str(os.path.join('sf','melody')))
-    harmony_soundfont = get_random_sound_font(str(os.path.join('sf','harmony')))
-    bassline_soundfont = get_random_sound_font(str(os.path.join('sf','bassline')))
+    beat_soundfont = get_random_sound_font(str(os.path.join('sf','beat')), rng)
+    melody_soundfont = get_random_sound_font(str(os.path.join('sf','melody')), rng)
+    harmony_soundfont = get_random_sound_font(str(os.path.join('sf','harmony')), rng)
+    bassline_soundfont = get_random_sound_font(str(os.path.join('sf','bassline')), rng)
     soundfonts['beat'] = beat_soundfont
     soundfonts['melody'] = melody_soundfont
     soundfonts['harmony'] = harmony_soundfont
@@ -471,10 +421,10 @@ def mix_and_save(harm_filename, bass_filename, melo_filename, beat_filename, nam
     print("Melody soundfont: " + melody_soundfont)
     print("Harmony soundfont: " + harmony_soundfont)
     print("Bassline soundfont: " + bassline_soundfont)
-    beat_board = generate_pedalboard('beat_fx.json')
-    melody_board = generate_pedalboard('melody_fx.json')
-    harmony_board = generate_pedalboard('harmony_fx.json')
-    bassline_board = generate_pedalboard('bassline_fx.json')    
+    beat_board = generate_pedalboard('beat_fx.json', rng)
+    melody_board = generate_pedalboard('melody_fx.json', rng)
+    harmony_board = generate_pedalboard('harmony_fx.json', rng)
+    bassline_board = generate_pedalboard('bassline_fx.json', rng)    
     pedalboards['beat'] = pedalboard_info_json(beat_board)
     pedalboards['melody'] = pedalboard_info_json(melody_board)
     pedalboards['harmony'] = pedalboard_info_json(harmony_board)
@@ -498,99 +448,164 @@ def mix_and_save(harm_filename, bass_filename, melo_filename, beat_filename, nam
         melody_proba = float(inst_proba[part]['melody'])
         harmony_proba = float(inst_proba[part]['harmony'])
         bassline_proba = float(inst_proba[part]['bassline'])
-        beat_part_mix[part] = (random.random() <= beat_proba) 
-        melody_part_mix[part] = (random.random() <= melody_proba)
-        harmony_part_mix[part] = (random.random() <= harmony_proba)
-        bassline_part_mix[part] = (random.random() <= bassline_proba)    
+        beat_part_mix[part] = (rng.random() <= beat_proba) 
+        melody_part_mix[part] = (rng.random() <= melody_proba)
+        harmony_part_mix[part] = (rng.random() <= harmony_proba)
+        bassline_part_mix[part] = (rng.random() <= bassline_proba)    
+    layers = ['beat', 'melody', 'harmony', 'bassline']
+    midi_filenames = {'beat': beat_filename, 'melody': melo_filename, 'harmony': harm_filename, 'bassline': bass_filename}
+    boards = {'beat': beat_board, 'melody': melody_board, 'harmony': harmony_board, 'bassline': bassline_board}
+    layer_part_mix = {'beat': beat_part_mix, 'melody': melody_part_mix, 'harmony': harmony_part_mix, 'bassline': bassline_part_mix}
+    # Rendered and processed layers are intermediates: they go to the scratch directory if there is one
+    if scratch_dir is None:
+        scratch_dir = name
+    # Render memo: (part, layer) -> processed layer (its samples in memory, its WAV file on disk),
+    # reused by repeated sections
+    rendered_layers = {}
+    sample_rate = renderer.sample_rate
+    part_frames = [mixer.duration_to_frames(part_durations[part], sample_rate) for part in song_arrangement]
+    # The song (and the optional per-layer stems, mixed with the same levels) is streamed to disk:
+    # every part is handed to the encoders of the output formats as soon as it is mixed, and
+    # they encode it on their own threads (see encoders.py). Stems use the first format.
+    output_formats = encoders.parse_formats(output_formats)
+    song_writer = encoders.open_output(os.path.join(name, name), output_formats, sample_rate)
+    song_files = song_writer.files
+    stem_files = {}
+    stem_writers = {}
+    try:
+        if stems:
+            for layer in layers:
+                stem_writers[layer] = encoders.open_output(os.path.join(name, name + '-' + layer), output_formats[:1], sample_rate)
+                stem_files[layer] = stem_writers[layer].files[output_formats[0]]
+    except Exception:
+        # End the streams already opened, or their encoder threads keep the process alive
+        song_writer.close()
+        for stem_writer in stem_writers.values():
+            stem_writer.close()
+        raise
     print("Mixing song parts...")
     song_transitions = []
-    song_time = 0
-    for part in song_arrangement:
-        this_transition = [part, song_time]
-        song_transitions.append(this_transition)
-        part_counter += 1
-        print("Mixing part: " + part + (' (' + str(part_counter) + ' of ' + str(number_of_parts) + ')'))        
-        # Render each MIDI file to an audio file using the chosen soundfont
-        beat_wav = 'beat' + "-" + str(part_counter) + "-" + part + ".wav"
-        beat_wav = os.path.join(name, beat_wav)
-        FluidSynth(beat_soundfont).midi_to_audio(beat_filename[part], beat_wav)
-        melo_wav = 'melody' + "-" + str(part_counter) + "-" + part + ".wav"
-        melo_wav = os.path.join(name, melo_wav)
-        FluidSynth(melody_soundfont).midi_to_audio(melo_filename[part], melo_wav)
-        harm_wav = 'harmony' + "-" + str(part_counter) + "-" + part + ".wav"
-        harm_wav = os.path.join(name, harm_wav)
-        FluidSynth(harmony_soundfont).midi_to_audio(harm_filename[part], harm_wav)
-        bass_wav = 'bassline' + "-" + str(part_counter) + "-" + part + ".wav"
-        bass_wav = os.path.join(name, bass_wav)
-        FluidSynth(bassline_soundfont).midi_to_audio(bass_filename[part], bass_wav)
-        # Load the rendered audio files, applying the effects defined in the JSON files
-        # TODO: optimize it so that the fx are only applied to the used layers
-        beat = AudioSegment.from_wav(apply_fx_to_layer(beat_wav, beat_board))
-        melody = AudioSegment.from_wav(apply_fx_to_layer(melo_wav, melody_board))
-        harmony = AudioSegment.from_wav(apply_fx_to_layer(harm_wav, harmony_board))
-        bassline = AudioSegment.from_wav(apply_fx_to_layer(bass_wav, bassline_board))
-        # Volume and panning for each layer
-        beat.volume = float(levels[part]['beat']['volume'])
-        melody.volume = float(levels[part]['melody']['volume'])
-        harmony.volume = float(levels[part]['harmony']['volume'])
-        bassline.volume = float(levels[part]['bassline']['volume'])
-        beat.pan(float(levels[part]['beat']['panning']))
-        melody.pan(float(levels[part]['melody']['panning']))
-        harmony.pan(float(levels[part]['harmony']['panning']))
-        bassline.pan(float(levels[part]['bassline']['panning']))      
-        # Create an empty AudioSegment to use as the initial mix
-        mix = AudioSegment.silent(duration=beat.duration_seconds*1000)
-        # Overlay each track onto the mix based on its probability value        
-        # TODO: if layer is chosen, apply effects (considering probability) and mix
-        # TODO: create a data structure to store which layers are used in each part
-        # Mix the audio files together
-        if beat_part_mix[part]:
-            mix = mix.overlay(beat)
-            if 'beat' not in part_layers[part]:
-                part_layers[part].append('beat')
-            print("Beat added to mix: "+part)
-        if melody_part_mix[part]:
-            mix = mix.overlay(melody)
-            if 'melody' not in part_layers[part]:
-                part_layers[part].append('melody')
-            print("Melody added to mix: "+part)
-        if harmony_part_mix[part]:
-            mix = mix.overlay(harmony)  
-            if 'harmony' not in part_layers[part]:
-                part_layers[part].append('harmony')         
-            print("Harmony added to mix: "+part)
-        if bassline_part_mix[part]:
-            mix = mix.overlay(bassline)
-            if 'bassline' not in part_layers[part]:
-                part_layers[part].append('bassline')
-            print("Bassline added to mix: "+part)
-        # Save the mixed audio to the output file
-        part_mix_file = name + '-' + str(part_counter) + '.wav'
-        part_mix_file = os.path.join(name, part_mix_file) 
-        mix.export(part_mix_file, format='wav')
-        song_parts.append(part_mix_file)
-        song_time = song_time + mix.duration_seconds
+    song_offset = 0
+    # Effects run on a thread pool: pedalboard releases the GIL, so the layers of a part are processed in parallel
+    fx_pool = ThreadPoolExecutor(max_workers=fx_workers)
+    layer_readers = {}
+    try:
+        if layer_timelines:
+            # One MIDI file, synth run and effects pass per layer for the whole song instead of one
+            # per part: the layer's parts follow the arrangement and are muted where it is left out
+            fx_jobs = {}
+            for layer in layers:
+                sections = [(midi_filenames[layer][part], part_durations[part], not layer_part_mix[layer][part]) for part in song_arrangement]
+                if all(muted for midi_file, duration, muted in sections):
+                    continue
+                timeline_midi = os.path.join(scratch_dir, name + '-' + layer + '-timeline.mid')
+                with tracing.span(tracer, 'midi_write', layer=layer):
+                    timeline.write_layer_timeline(timeline_midi, sections, layer.capitalize())
+                layer_wav = os.path.join(scratch_dir, layer + '-timeline.wav')
+                with tracing.span(tracer, 'render', layer=layer):
+                    rendered = render_layer(timeline_midi, soundfonts[layer], layer_wav, renderer, in_memory)
+                fx_jobs[layer] = fx_pool.submit(tracing.call_in_span, tracer, 'fx', {'layer': layer},
+                                                process_layer, rendered, boards[layer], sample_rate, in_memory, fx_block_size)
+            for layer, fx_job in fx_jobs.items():
+                layer_readers[layer] = timeline.LayerReader(fx_job.result())
+        for part, frames in zip(song_arrangement, part_frames):
+            with tracing.span(tracer, 'mix_part', part=part, index=len(song_transitions)):
+                this_transition = [part, song_offset / sample_rate]
+                song_transitions.append(this_transition)
+                part_counter += 1
+                print("Mixing part: " + part + (' (' + str(part_counter) + ' of ' + str(number_of_parts) + ')'))        
+                mix = mixer.create_mix_buffer(frames)
+                stem_mixes = {layer: mixer.create_mix_buffer(frames) for layer in stem_writers}
+                # Only the layers chosen for this part are rendered, processed and mixed;
+                # each (part, layer) is rendered the first time its part shows up in the arrangement
+                part_mix_layers = [layer for layer in layers if layer_part_mix[layer][part]]
+                if layer_timelines:
+                    # Every timeline is mixed, muted layers too, so the tails of the previous section ring on
+                    part_audio = {layer: layer_reader.read(frames) for layer, layer_reader in layer_readers.items()}
+                else:
+                    fx_jobs = {}
+                    for layer in part_mix_layers:
+                        if (part, layer) not in rendered_layers:
+                            layer_wav = layer + "-" + str(part_counter) + "-" + part + ".wav"
+                            layer_wav = os.path.join(scratch_dir, layer_wav)
+                            with tracing.span(tracer, 'render', part=part, layer=layer):
+                                rendered = render_layer(midi_filenames[layer][part], soundfonts[layer], layer_wav, renderer, in_memory)
+                            fx_jobs[layer] = fx_pool.submit(tracing.call_in_span, tracer, 'fx', {'part': part, 'layer': layer},
+                                                            process_layer, rendered, boards[layer], sample_rate, in_memory, fx_block_size)
+                    for layer, fx_job in fx_jobs.items():
+                        rendered_layers[(part, layer)] = fx_job.result()
+                    # On disk only the processed files are memoised: a part's layers are read back as it is mixed
+                    part_audio = {layer: load_layer(rendered_layers[(part, layer)]) for layer in part_mix_layers}
+                with tracing.span(tracer, 'mix', part=part):
+                    for layer, samples in part_audio.items():
+                        # Volume and panning for the layer
+                        volume = float(levels[part][layer]['volume'])
+                        pan = float(levels[part][layer]['panning'])
+                        mixer.mix_layer(mix, samples, volume, pan)
+                        if layer in stem_mixes:
+                            mixer.mix_layer(stem_mixes[layer], samples, volume, pan)
+                for layer in part_mix_layers:
+                    if layer not in part_layers[part]:
+                        part_layers[part].append(layer)
+                    print(layer.capitalize() + " added to mix: "+part)
+                # Append the finished part to the song and stems (and to the analysis copy used for scoring)
+                with tracing.span(tracer, 'export', part=part):
+                    song_writer.write(mixer.limit(mix))
+                    for layer, stem_mix in stem_mixes.items():
+                        stem_writers[layer].write(mixer.limit(stem_mix))
+                if analysis is not None:
+                    with tracing.span(tracer, 'analysis', part=part):
+                        analysis.add_part(part, mix)
+                song_offset += frames
+    finally:
+        fx_pool.shutdown()
+        for layer_reader in layer_readers.values():
+            layer_reader.close()
+        # Closing the writers queues the end of the streams; the encoders then complete the files
+        song_writer.close()
+        for stem_writer in stem_writers.values():
+            stem_writer.close()
+    # Without wait_for_encoders the song is still being encoded when this returns, and is
+    # waited for with encoders.wait_for_pending
+    outputs = [song_writer] + list(stem_writers.values())
+    if wait_for_encoders:
+        for output in outputs:
+            output.wait()
+    else:
+        encoders.add_pending(name, outputs)
     
-    this_transition = ['end', song_time]
+    this_transition = ['end', song_offset / sample_rate]
     song_transitions.append(this_transition)
-    # Iterate through song_parts and concatenate them into a single file
-    song = AudioSegment.from_wav(song_parts[0])
-    for part_wav in song_parts[1:]:
-        song += AudioSegment.from_wav(part_wav)
-    # Save the song as a wav file
-    song_file_wav = name + '.wav'
-    song_file_wav = os.path.join(name, song_file_wav)
-    song.export(song_file_wav, format='wav')
-    print("Song saved as: " + song_file_wav)
-    # Clean the wav parts
-    for part_wav in song_parts:
-        os.remove(part_wav)
+    for song_file in song_files.values():
+        print("Song saved as: " + song_file)
+    for layer, stem_file in stem_files.items():
+        print(layer.capitalize() + " stem saved as: " + stem_file)
         
-    return song_file_wav, song_arrangement, song_transitions, soundfonts, pedalboards, part_layers
+    return song_files, song_arrangement, song_transitions, soundfonts, pedalboards, part_layers, stem_files
 
 # Create song file and metadata
-def create_song(key, tempo, time_signature, measures, name, chord_pat_file, beat_pat_file):
+# Every random choice of the song comes from one random.Random seeded with `seed`, so the same
+# arguments and seed regenerate the same song. Settings passed as None are drawn from it too.
+# The song is encoded in each of output_formats ('wav', 'flac', 'ogg', 'opus'); with
+# wait_for_encoders=False it returns while they are still encoding (see encoders.wait_for_pending).
+def create_song(key, tempo, time_signature, measures, name, chord_pat_file, beat_pat_file, renderer=None, in_memory=False, stems=False, seed=None,
+                fx_workers=4, fx_block_size=None, analysis_sr=musicality_score.ANALYSIS_SAMPLE_RATE,
+                analysis_res_type=musicality_score.ANALYSIS_RES_TYPE, full_analysis=False, trace=False,
+                resources=False, layer_timelines=False, scratch_dir=None, keep_intermediates=False,
+                output_formats=('wav',), wait_for_encoders=True):
+    if seed is None:
+        seed = random.randrange(2**32)
+    rng = random.Random(seed)
+    if key is None:
+        key = generate_random_key(rng)
+    if tempo is None:
+        tempo = generate_random_tempo(rng)
+    if time_signature is None:
+        time_signature = generate_random_time_signature(rng)
+    if measures is None:
+        measures = generate_song_measures(rng)
     song_info = {}
+    song_info['seed'] = seed
     song_info['key'] = key
     song_info['tempo'] = tempo
     song_info['time_signature'] = time_signature
@@ -605,67 +620,99 @@ def create_song(key, tempo, time_signature, measures, name, chord_pat_file, beat
     song_name = name
 
     start_time = time.time()
+    # Every stage of the song is traced: the totals go into the annotations and, with trace,
+    # the whole trace is saved for chrome://tracing or Perfetto. With resources, the stages also
+    # record memory, CPU, subprocesses and bytes written (see tracing.py)
+    tracer = tracing.Tracer(resources)
+    song_span = tracer.begin('song')
+    try:
     
-    ha, ba, me, be = generate_song_parts(key, tempo, time_signature, measures, song_name, chord_pat_file, beat_pat_file)
-    wav_name, arrangement, transitions, soundfonts, pedalboards, part_layers = mix_and_save(ha, ba, me, be, song_name)
+        if renderer is None:
+            renderer = renderers.get_renderer()
+        # The song is scored while it is mixed, not by reading the wav back (analysis_sr=None analyses
+        # it at the renderer's rate): each part is analysed as soon as it is mixed and the song score
+        # is aggregated from the parts, or with full_analysis the whole song is analysed at the end
+        if full_analysis:
+            analysis = musicality_score.AnalysisBuffer(renderer.sample_rate, analysis_sr, analysis_res_type)
+        else:
+            # Repeated sections of layer timelines differ (tails of the previous section carry over),
+            # so each one is analysed
+            analysis = musicality_score.PartAnalyzer(renderer.sample_rate, analysis_sr, analysis_res_type, tracer,
+                                                     reuse_repeats=not layer_timelines)
+        # Part MIDI files and rendered layers live in a scratch workspace (under scratch_dir, the
+        # system temporary directory by default) that is removed once the song is mixed, or if it
+        # fails, unless keep_intermediates is set; the song directory only gets the outputs
+        os.makedirs(song_name, exist_ok=True)
+        with workspace.Workspace(song_name, scratch_dir, keep_intermediates) as song_workspace:
+            with tracer.span('generate_song_parts'):
+                ha, ba, me, be, du = generate_song_parts(key, tempo, time_signature, measures, song_name, chord_pat_file, beat_pat_file, rng, tracer,
+                                                         song_workspace.path)
+            with tracer.span('mix_and_save'):
+                song_files, arrangement, transitions, soundfonts, pedalboards, part_layers, stem_files = mix_and_save(ha, ba, me, be, du, song_name, renderer, in_memory, stems, rng,
+                                                                                                                 fx_workers, fx_block_size, analysis, tracer, layer_timelines,
+                                                                                                                 song_workspace.path, output_formats, wait_for_encoders)
+        if keep_intermediates:
+            song_info['intermediates'] = song_workspace.path
     
-    end_time = time.time()
+        end_time = time.time()
     
-    song_info['file_name'] = wav_name
-    song_info['arrangement'] = arrangement
-    song_info['transitions'] = transitions
-    song_info['soundfonts'] = soundfonts
-    song_info['pedalboards'] = pedalboards
-    song_info['part_layers'] = part_layers
-    song_info['musicality_score'] = musicality_score.get_musicality_score(wav_name)
+        # The file of the first output format, and the files of all of them by format
+        song_file = next(iter(song_files.values()))
+        song_info['file_name'] = song_file
+        song_info['files'] = song_files
+        song_info['arrangement'] = arrangement
+        song_info['transitions'] = transitions
+        song_info['soundfonts'] = soundfonts
+        song_info['pedalboards'] = pedalboards
+        song_info['part_layers'] = part_layers
+        song_info['layer_timelines'] = layer_timelines
+        if stem_files:
+            song_info['stems'] = stem_files
+        # The feature summaries are kept so the song can be rescored with other weights (see rescore.py)
+        with tracer.span('score'):
+            features = analysis.get_features()
+            song_info['musicality_features'] = features
+            song_info['musicality_score'] = musicality_score.score_features(features) if features is not None else None
+            part_musicality = {}
+            for part, part_features in analysis.get_part_features().items():
+                part_score = musicality_score.score_features(part_features) if part_features is not None else None
+                part_musicality[part] = {'musicality_score': part_score, 'musicality_features': part_features}
+        if part_musicality:
+            song_info['part_musicality'] = part_musicality
+        tracer.end(song_span)
+    finally:
+        # Stops tracemalloc (with resources) even if the generation fails
+        tracer.close()
+    if resources:
+        song_info['resources'] = tracer.resources_of('song')
+    # Seconds (and resources) spent in every stage, over the whole song and by part and layer
+    # (effects and part scoring run on other threads, so stages can add up to more than the song)
+    song_info['timings'] = {'stages': tracer.totals(), 'parts': tracer.totals('part'), 'layers': tracer.totals('layer')}
     
     elapsed_time = end_time - start_time
     print(f'Elapsed time: {elapsed_time:.2f} seconds')
-    print(f'Musicality score: {song_info["musicality_score"]:.2f}')
+    if song_info['musicality_score'] is not None:
+        print(f'Musicality score: {song_info["musicality_score"]:.2f}')
+    else:
+        print('Musicality score: none (silent song)')
+    for part, part_info in part_musicality.items():
+        if part_info['musicality_score'] is not None:
+            print(f'\t{part}: {part_info["musicality_score"]:.2f}')
     
     json_file = os.path.join(name, name + '.json')
     
     print('Annotations: ' + json_file)
     
+    if trace:
+        song_info['trace_file'] = tracer.save_chrome_trace(os.path.join(name, name + '-trace.json'))
+        print('Trace: ' + song_info['trace_file'])
+
     with open(json_file, 'w') as outfile:
         json.dump(song_info, outfile, indent=4)
 
-    # TODO: clean temp files in a better way (ATS)
-    # TODO generate stems for each layer / the whole song
-    midi_del = "*.mid"
-    midi_path = os.path.join(name, midi_del)
-    midi_files = glob.glob(midi_path)
-    # for midi_file in midi_files:
-        # os.remove(midi_file)
-    
-    wav_del = "beat-*.wav" 
-    wav_path = os.path.join(name, wav_del)
-    wav_files = glob.glob(wav_path)
-    # for wav_file in wav_files:
-        # os.remove(wav_file)
-
-    wav_del = "bassline-*.wav" 
-    wav_path = os.path.join(name, wav_del)
-    wav_files = glob.glob(wav_path)
-    # for wav_file in wav_files:
-        # os.remove(wav_file)
-
-    wav_del = "harmony-*.wav" 
-    wav_path = os.path.join(name, wav_del)
-    wav_files = glob.glob(wav_path)
-    # for wav_file in wav_files:
-        # os.remove(wav_file)
-
-    wav_del = "melody-*.wav" 
-    wav_path = os.path.join(name, wav_del)
-    wav_files = glob.glob(wav_path)
-    # for wav_file in wav_files:
-        # os.remove(wav_file)
+    return song_file, json_file
 
-    
-    return wav_name, json_file
-
-def generate_random_key():
+def generate_random_key(rng=random):
     # https://www.digitaltrends.com/music/whats-the-most-popular-music-key-spotify/
     # https://web.archive.org/web/20190426230344/https://insights.spotify.com/us/2015/05/06/most-popular-keys-on-spotify/
     # https://forum.bassbuzz.com/t/most-used-keys-on-spotify/5886
@@ -675,34 +722,34 @@ def generate_random_key():
                   (0.748, 'A#m'), (0.778, 'Fm'), (0.805, 'F#'), (0.831, 'B'), (0.857, 'Gm'), (0.883, 'Dm'),
                   (0.908, 'F#m'), (0.932, 'D#'), (0.956, 'Cm'), (0.977, 'C#m'), (0.989, 'G#m'), (1.0, 'D#m')
     ]
-    dice = random.random()
+    dice = rng.random()
     for prob, key in key_ranges:
         if dice < prob:
             return key    
 
-def generate_random_tempo():
+def generate_random_tempo(rng=random):
     # https://blog.musiio.com/2021/08/19/which-musical-tempos-are-people-streaming-the-most/
     tempo_ranges = [(0.0183, 60, 70), (0.0454, 70, 80), (0.1849, 80, 90), (0.3721, 90, 100),
                     (0.4817, 100, 110), (0.5747, 110, 120), (0.7048, 120, 130), (0.7917, 130, 140),
                     (0.8958, 140, 150), (0.9739, 150, 160), (1.0, 160, 170)]
-    dice = random.random()
+    dice = rng.random()
     for prob, min_tempo, max_tempo in tempo_ranges:
         if dice < prob:
-            return random.randint(min_tempo, max_tempo)
+            return rng.randint(min_tempo, max_tempo)
 
-def generate_random_time_signature():
+def generate_random_time_signature(rng=random):
     time_signature_ranges = [(0.6, '4/4'), (0.75, '3/4'), (0.90, '2/4'), (1.0, '6/8')]
-    dice = random.random()
+    dice = rng.random()
     for prob, time_signature in time_signature_ranges:
         if dice < prob:
             return time_signature  
 
-def generate_song_measures():
-    intro_len = random.choice([8, 16, 32])
-    verse_len = random.choice([16, 32, 32, 64]) # Repeated to emphasize more common verse lengths
-    chorus_len = random.choice([16,32])
-    bridge_len = random.choice([8, 16, 16, 32]) # Repeated to emphasize more common bridge lengths
-    outro_len = random.choice([8,16,32])
+def generate_song_measures(rng=random):
+    intro_len = rng.choice([8, 16, 32])
+    verse_len = rng.choice([16, 32, 32, 64]) # Repeated to emphasize more common verse lengths
+    chorus_len = rng.choice([16,32])
+    bridge_len = rng.choice([8, 16, 16, 32]) # Repeated to emphasize more common bridge lengths
+    outro_len = rng.choice([8,16,32])
     song_measures = {
         'intro': intro_len,
         'verse': verse_len,
@@ -712,13 +759,19 @@ def generate_song_measures():
     }
     return song_measures
 
-# Example usage
-
-for i in range(10):
-    key = generate_random_key()
-    tempo = generate_random_tempo()
-    time_signature = generate_random_time_signature()
-    song_measures = generate_song_measures()
+# Unique song name: the timestamp keeps names sortable and the random suffix keeps
+# songs finished in the same second (or on other workers) from sharing a directory
+def generate_song_id():
     now = datetime.now()
-    song_name = now.strftime("%Y%m%d%H%M%S")
-    create_song(key, tempo, time_signature, song_measures, song_name, 'chord_patterns.txt', 'beat_roll_patterns.txt')
+    return now.strftime("%Y%m%d%H%M%S") + "_" + uuid.uuid4().hex[:8]
+
+# Example usage (see batch.py to generate songs in parallel)
+
+if __name__ == '__main__':
+    for i in range(10):
+        key = generate_random_key()
+        tempo = generate_random_tempo()
+        time_signature = generate_random_time_signature()
+        song_measures = generate_song_measures()
+        song_name = generate_song_id()
+        create_song(key, tempo, time_signature, song_measures, song_name, 'chord_patterns.txt', 'beat_patterns.txt')
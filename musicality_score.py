@@ -1,128 +1,372 @@
 import sys
+import time
 import librosa
 import numpy as np
+import soxr
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from scipy.stats import entropy
+import tracing
 
-def calculate_musicality(filename, tempo_weight, spectral_contrast_weight, chroma_feature_weight, tonnetz_feature_weight, zero_crossing_rate_weight, mfcc_weight, spectral_centroid_weight, spectral_rolloff_weight, rms_weight, beat_sync_features_weight, audio_length_weight, entropy_weight):
+# Audio is analysed in mono at librosa's default rate. In-memory audio is resampled with a
+# fast resampler (any librosa res_type), instead of the high quality one used by librosa.load
+ANALYSIS_SAMPLE_RATE = 22050
+ANALYSIS_RES_TYPE = 'soxr_qq'
 
-    # Load the audio file
-    y, sr = librosa.load(filename)
+# Analysis settings. The draft mode is a cheap screening pass: half the sample rate, 4x larger
+# hops, a fast resampler, no tonnetz (constant-Q) or beat tracking, and silent or white noise
+# audio is rejected right after the cheap features
+DRAFT_FEATURES = ['spectral_contrast', 'chroma_feature', 'zero_crossing_rate', 'mfcc', 'spectral_centroid',
+                  'spectral_rolloff', 'rms', 'audio_length_factor', 'entropy']
+ANALYSIS_MODES = {
+    'full': {'sample_rate': 22050, 'res_type': 'soxr_hq', 'hop_length': 512, 'features': None, 'early_reject': False},
+    'draft': {'sample_rate': 11025, 'res_type': 'soxr_qq', 'hop_length': 2048, 'features': DRAFT_FEATURES, 'early_reject': True},
+}
+# Early reject thresholds: peak amplitude of silence, and lag-1 autocorrelation of white noise
+# (about 0, while rendered music is strongly correlated from one sample to the next). The
+# entropy flag is_white_noise grows with the length of the audio, so it can't reject anything.
+SILENCE_THRESHOLD = 1e-4
+WHITE_NOISE_CORRELATION = 0.1
 
-    # Calculate the Tempo
-    tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
+# Every feature is derived from a few representations computed once per signal: the magnitude
+# spectrogram, its mel spectrogram and the onset envelope (beat tracking runs once on it).
+# Tonnetz needs a constant-Q chroma, and the zero crossing rate, RMS energy and entropy are
+# measured on the signal itself. The cheap features come first; with early_reject, silent or
+# white noise audio returns right after them, with the reason in features['rejected'].
+# Only the features in feature_names (all of them by default) are computed.
+# Pass a dict as timings to get the wall and CPU time of every step (see timed).
+def extract_features(y, sr, hop_length=512, feature_names=None, early_reject=False, timings=None):
+    features = {}
 
-    # Calculate the Spectral Contrast
-    spectral_contrast = librosa.feature.spectral_contrast(y=y, sr=sr)
+    def wanted(*names):
+        return feature_names is None or any(name in feature_names for name in names)
 
-    # Calculate the Chroma Feature
-    chroma_feature = librosa.feature.chroma_stft(y=y, sr=sr)
+    # Calculate audio length factor
+    with timed(timings, 'audio_length_factor'):
+        audio_length = librosa.get_duration(y=y, sr=sr)
+        features['audio_length_factor'] = 1.0 if audio_length >= 30 else audio_length / 30
 
-    # Calculate the Tonnetz Feature
-    tonnetz_feature = librosa.feature.tonnetz(y=y, sr=sr)
+    if early_reject and (len(y) == 0 or np.max(np.abs(y)) < SILENCE_THRESHOLD):
+        features['rejected'] = 'silence'
+        return features
 
-    # Calculate the Zero Crossing Rate
-    zero_crossing_rate = librosa.feature.zero_crossing_rate(y=y)
+    # Calculate probability distribution and entropy
+    with timed(timings, 'entropy'):
+        prob_distribution = np.abs(y) / np.sum(np.abs(y))
+        features['entropy'] = float(entropy(prob_distribution))
 
-    # Calculate the MFCCs
-    mfcc = librosa.feature.mfcc(y=y, sr=sr)
+    # Check for white noise
+    features['is_white_noise'] = bool(features['entropy'] > 8.0)
 
-    # Calculate the Spectral Centroid
-    spectral_centroid = librosa.feature.spectral_centroid(y=y, sr=sr)
+    if early_reject and abs(lag_correlation(y)) < WHITE_NOISE_CORRELATION:
+        features['rejected'] = 'white_noise'
+        return features
 
-    # Calculate the Spectral Rolloff
-    spectral_rolloff = librosa.feature.spectral_rolloff(y=y, sr=sr)
+    if wanted('zero_crossing_rate'):
+        with timed(timings, 'zero_crossing_rate'):
+            features['zero_crossing_rate'] = normalized_mean(librosa.feature.zero_crossing_rate(y=y, hop_length=hop_length))
+    if wanted('rms'):
+        with timed(timings, 'rms'):
+            features['rms'] = normalized_mean(librosa.feature.rms(y=y, hop_length=hop_length))
 
-    # Calculate the RMS Energy
-    rms = librosa.feature.rms(y=y)
+    if wanted('tempo', 'spectral_contrast', 'chroma_feature', 'mfcc', 'spectral_centroid', 'spectral_rolloff', 'beat_sync_features'):
+        # Shared spectrograms (n_fft=2048, librosa's default)
+        with timed(timings, 'spectrogram'):
+            S = np.abs(librosa.stft(y, hop_length=hop_length))
+            power = S ** 2
+        with timed(timings, 'mel_spectrogram'):
+            log_mel = librosa.power_to_db(librosa.feature.melspectrogram(S=power, sr=sr))
 
-    # Calculate the Beat Sync Features
-    tempo, beats = librosa.beat.beat_track(y=y, sr=sr)
-    beat_sync_features = librosa.util.sync(y, beats)
+    if wanted('tempo', 'beat_sync_features'):
+        with timed(timings, 'onset_envelope'):
+            onset_envelope = librosa.onset.onset_strength(S=log_mel, sr=sr, hop_length=hop_length, aggregate=np.median)
+        # Calculate the Tempo and the beats
+        with timed(timings, 'tempo'):
+            tempo, beats = librosa.beat.beat_track(onset_envelope=onset_envelope, sr=sr, hop_length=hop_length)
+            tempo = (tempo - 40) / (240 - 40)
+            tempo = 1 - abs(tempo - 0.5)
+            features['tempo'] = float(np.mean(tempo))
+        with timed(timings, 'beat_sync_features'):
+            features['beat_sync_features'] = normalized_mean(librosa.util.sync(y, beats))
 
-    # Normalize the features
-    tempo = (tempo - 40) / (240 - 40)
-    tempo = 1 - abs(tempo - 0.5)
+    if wanted('spectral_contrast'):
+        with timed(timings, 'spectral_contrast'):
+            # librosa's 6 octave bands from 200 Hz need a sample rate above 12.8 kHz; lower
+            # analysis rates (the draft mode) use as many bands as fit below Nyquist
+            n_bands = min(6, int(np.ceil(np.log2(sr / 2 / 200))))
+            features['spectral_contrast'] = normalized_mean(librosa.feature.spectral_contrast(S=S, sr=sr, n_bands=n_bands))
+    if wanted('chroma_feature'):
+        with timed(timings, 'chroma_feature'):
+            features['chroma_feature'] = normalized_mean(librosa.feature.chroma_stft(S=power, sr=sr))
+    if wanted('tonnetz_feature'):
+        with timed(timings, 'tonnetz_feature'):
+            features['tonnetz_feature'] = normalized_mean(librosa.feature.tonnetz(y=y, sr=sr, hop_length=hop_length))
+    if wanted('mfcc'):
+        with timed(timings, 'mfcc'):
+            features['mfcc'] = normalized_mean(librosa.feature.mfcc(S=log_mel, sr=sr))
+    if wanted('spectral_centroid'):
+        with timed(timings, 'spectral_centroid'):
+            features['spectral_centroid'] = normalized_mean(librosa.feature.spectral_centroid(S=S, sr=sr))
+    if wanted('spectral_rolloff'):
+        with timed(timings, 'spectral_rolloff'):
+            features['spectral_rolloff'] = normalized_mean(librosa.feature.spectral_rolloff(S=S, sr=sr))
 
-    spectral_contrast = (spectral_contrast - np.min(spectral_contrast)) / (np.max(spectral_contrast) - np.min(spectral_contrast))
-    chroma_feature = (chroma_feature - np.min(chroma_feature)) / (np.max(chroma_feature) - np.min(chroma_feature))
-    tonnetz_feature = (tonnetz_feature - np.min(tonnetz_feature)) / (np.max(tonnetz_feature) - np.min(tonnetz_feature))
-    zero_crossing_rate = (zero_crossing_rate - np.min(zero_crossing_rate)) / (np.max(zero_crossing_rate) - np.min(zero_crossing_rate))
-    mfcc = (mfcc - np.min(mfcc)) / (np.max(mfcc) - np.min(mfcc))
-    spectral_centroid = (spectral_centroid - np.min(spectral_centroid)) / (np.max(spectral_centroid) - np.min(spectral_centroid))
-    spectral_rolloff = (spectral_rolloff - np.min(spectral_rolloff)) / (np.max(spectral_rolloff) - np.min(spectral_rolloff))
-    rms = (rms - np.min(rms)) / (np.max(rms) - np.min(rms))
-    beat_sync_features = (beat_sync_features - np.min(beat_sync_features)) / (np.max(beat_sync_features) - np.min(beat_sync_features))
+    return features
 
-    # Calculate audio length factor
-    audio_length = librosa.get_duration(y=y, sr=sr)
-    audio_length_factor = 1.0 if audio_length >= 30 else audio_length / 30
+# Adds the wall and CPU (process) time of the block to timings[name], in seconds.
+# Does nothing when timings is None.
+@contextmanager
+def timed(timings, name):
+    if timings is None:
+        yield
+        return
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield
+    finally:
+        step = timings.setdefault(name, {'wall': 0.0, 'cpu': 0.0})
+        step['wall'] += time.perf_counter() - wall_start
+        step['cpu'] += time.process_time() - cpu_start
 
-    # Calculate probability distribution and entropy
+# Correlation between consecutive samples
+def lag_correlation(y):
+    if len(y) < 2:
+        return 0.0
+    a = y[:-1] - np.mean(y[:-1])
+    b = y[1:] - np.mean(y[1:])
+    norm = np.sqrt(np.dot(a, a) * np.dot(b, b))
+    return float(np.dot(a, b) / norm) if norm > 0 else 0.0
+
+# Features of an audio file with the settings of an analysis mode ('full' or 'draft'); the mode
+# is reported in features['analysis_mode']. feature_names overrides the mode's feature subset.
+def analyse_file(filename, mode='full', feature_names=None, timings=None):
+    settings = ANALYSIS_MODES[mode]
+    # Load the audio file
+    with timed(timings, 'load'):
+        y, sr = librosa.load(filename, sr=settings['sample_rate'], res_type=settings['res_type'])
+    if feature_names is None:
+        feature_names = settings['features']
+    features = extract_features(y, sr, settings['hop_length'], feature_names, settings['early_reject'], timings)
+    features['analysis_mode'] = mode
+    return features
 
-    prob_distribution = np.abs(y) / np.sum(np.abs(y))
-    entropy_value = entropy(prob_distribution)
+# Mean of a feature after scaling it to [0, 1]
+def normalized_mean(feature):
+    feature = (feature - np.min(feature)) / (np.max(feature) - np.min(feature))
+    return float(np.mean(feature))
 
-    # Check for white noise
-    is_white_noise = entropy_value > 8.0
-
-    # Calculate the musicality based on the extracted features and their weights
-    musicality = (
-            np.mean(tempo) * tempo_weight +
-            np.mean(spectral_contrast) * spectral_contrast_weight +
-            np.mean(chroma_feature) * chroma_feature_weight +
-            np.mean(tonnetz_feature) * tonnetz_feature_weight +
-            np.mean(zero_crossing_rate) * zero_crossing_rate_weight +
-            np.mean(mfcc) * mfcc_weight +
-            np.mean(spectral_centroid) * spectral_centroid_weight +
-            np.mean(spectral_rolloff) * spectral_rolloff_weight +
-            np.mean(rms) * rms_weight +
-            np.mean(beat_sync_features) * beat_sync_features_weight +
-            audio_length_factor * audio_length_weight -
-            entropy_value * entropy_weight -
-            (0.5 if is_white_noise else 0.0)
-        )
+# Weight of every feature in the score. The entropy is subtracted, and white noise costs
+# WHITE_NOISE_PENALTY on top of it
+DEFAULT_WEIGHTS = {
+    'tempo': 0.05,
+    'spectral_contrast': 0.05,
+    'chroma_feature': 0.2,
+    'tonnetz_feature': 0.05,
+    'zero_crossing_rate': 0.02,
+    'mfcc': 0.3,
+    'spectral_centroid': 0.1,
+    'spectral_rolloff': 0.1,
+    'rms': 0.05,
+    'beat_sync_features': 0.1,
+    'audio_length_factor': 0.1,
+    'entropy': 0.1,
+}
+FEATURE_NAMES = list(DEFAULT_WEIGHTS)
+WHITE_NOISE_PENALTY = 0.5
 
+# Weights in FEATURE_NAMES order, signed as they enter the score; features missing
+# from `weights` keep their default weight
+def weight_vector(weights=DEFAULT_WEIGHTS):
+    weights = dict(DEFAULT_WEIGHTS, **weights)
+    return np.array([-weights[name] if name == 'entropy' else weights[name] for name in FEATURE_NAMES])
+
+# Feature summaries of many songs as a matrix (one row per song, FEATURE_NAMES order)
+# plus their white noise flags. Features a draft analysis skipped count as 0.
+def feature_matrix(feature_sets):
+    matrix = np.array([[features.get(name, 0.0) for name in FEATURE_NAMES] for features in feature_sets], dtype=np.float64)
+    white_noise = np.array([bool(features.get('is_white_noise', False)) for features in feature_sets])
+    return matrix.reshape(-1, len(FEATURE_NAMES)), white_noise
+
+# Scores of every row with one matrix-vector product, so songs can be re-ranked with new
+# weights from their stored features without analysing the audio again
+def score_feature_matrix(matrix, white_noise, weights=DEFAULT_WEIGHTS):
+    musicality = matrix @ weight_vector(weights) - WHITE_NOISE_PENALTY * white_noise
     # Normalize the musicality value
-    musicality_value = (musicality * -1)
-    musicality_value = musicality_value - 1
-
-    return musicality_value
-
-def get_musicality_score(filename):
-    # Define weights for each feature
-    tempo_weight = 0.05
-    spectral_contrast_weight = 0.05
-    chroma_feature_weight = 0.2
-    tonnetz_feature_weight = 0.05
-    zero_crossing_rate_weight = 0.02
-    mfcc_weight = 0.3
-    spectral_centroid_weight = 0.1
-    spectral_rolloff_weight = 0.1
-    rms_weight = 0.05
-    beat_sync_features_weight = 0.1
-    audio_length_weight = 0.1
-    entropy_weight = 0.1
-    musicality = calculate_musicality(filename, tempo_weight, spectral_contrast_weight, chroma_feature_weight, tonnetz_feature_weight, zero_crossing_rate_weight, mfcc_weight, spectral_centroid_weight, spectral_rolloff_weight, rms_weight, beat_sync_features_weight, audio_length_weight, entropy_weight)
-    return musicality
+    return -musicality - 1
+
+def rescore(feature_sets, weights=DEFAULT_WEIGHTS):
+    matrix, white_noise = feature_matrix(feature_sets)
+    return score_feature_matrix(matrix, white_noise, weights)
+
+def score_features(features, weights=DEFAULT_WEIGHTS):
+    return float(rescore([features], weights)[0])
+
+# mode='draft' gives a cheap screening score (see ANALYSIS_MODES). Returns the score and the features:
+# features['analysis_mode'] is the mode that produced it, and audio the mode rejects has no score
+# (None) and the reason in features['rejected']
+def calculate_musicality(filename, tempo_weight, spectral_contrast_weight, chroma_feature_weight, tonnetz_feature_weight, zero_crossing_rate_weight, mfcc_weight, spectral_centroid_weight, spectral_rolloff_weight, rms_weight, beat_sync_features_weight, audio_length_weight, entropy_weight,
+                         mode='full', feature_names=None):
+
+    features = analyse_file(filename, mode, feature_names)
+
+    if 'rejected' in features:
+        return None, features
+    weights = dict(zip(FEATURE_NAMES, [tempo_weight, spectral_contrast_weight, chroma_feature_weight, tonnetz_feature_weight, zero_crossing_rate_weight, mfcc_weight, spectral_centroid_weight, spectral_rolloff_weight, rms_weight, beat_sync_features_weight, audio_length_weight, entropy_weight]))
+    return score_features(features, weights), features
+
+# Same as calculate_musicality, with DEFAULT_WEIGHTS: (score, features)
+def get_musicality_score(filename, mode='full'):
+    features = analyse_file(filename, mode)
+    if 'rejected' in features:
+        return None, features
+    return score_features(features), features
+
+# Features of audio that is already in memory, shaped (frames,) or (channels, frames): it is mixed
+# down to mono and resampled to analysis_sr, or analysed at its own rate if analysis_sr is None
+def get_features_from_audio(y, sr, analysis_sr=ANALYSIS_SAMPLE_RATE, res_type=ANALYSIS_RES_TYPE):
+    y, sr = to_analysis_audio(y, sr, analysis_sr, res_type)
+    return extract_features(y, sr)
+
+def to_analysis_audio(y, sr, analysis_sr=ANALYSIS_SAMPLE_RATE, res_type=ANALYSIS_RES_TYPE):
+    y = librosa.to_mono(np.asarray(y, dtype=np.float32))
+    if analysis_sr is not None and analysis_sr != sr:
+        y = librosa.resample(y, orig_sr=sr, target_sr=analysis_sr, res_type=res_type)
+        sr = analysis_sr
+    return y, sr
+
+def get_musicality_score_from_audio(y, sr, analysis_sr=ANALYSIS_SAMPLE_RATE, res_type=ANALYSIS_RES_TYPE):
+    return score_features(get_features_from_audio(y, sr, analysis_sr, res_type))
+
+# Mono copy of a song at the analysis rate, built part by part while the song is written,
+# so it can be scored without reading the file back. Parts go through one streaming soxr
+# resampler, which gives the same samples as resampling the whole song at once.
+class AnalysisBuffer:
+    def __init__(self, sample_rate, analysis_sr=ANALYSIS_SAMPLE_RATE, res_type=ANALYSIS_RES_TYPE):
+        self.sample_rate = sample_rate
+        self.resampler = None
+        if analysis_sr is not None and analysis_sr != sample_rate:
+            if not res_type.startswith('soxr_'):
+                raise ValueError('Streaming analysis needs a soxr resampler, got: ' + res_type)
+            self.resampler = soxr.ResampleStream(sample_rate, analysis_sr, 1, dtype='float32', quality=res_type[len('soxr_'):].upper())
+            self.sample_rate = analysis_sr
+        self.chunks = []
+
+    # Parts are added in song order; the part name is not needed for a whole song analysis
+    def add_part(self, part, samples):
+        self.append(samples)
+
+    def append(self, samples):
+        y = librosa.to_mono(np.asarray(samples, dtype=np.float32))
+        if self.resampler is not None:
+            y = self.resampler.resample_chunk(y)
+        self.chunks.append(y)
+
+    def get_audio(self):
+        if self.resampler is not None:
+            # Flush the resampler
+            self.chunks.append(self.resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True))
+            self.resampler = None
+        self.chunks = [np.concatenate(self.chunks)] if self.chunks else []
+        return self.chunks[0] if self.chunks else np.zeros(0, dtype=np.float32)
+
+    def get_features(self):
+        return get_features_from_audio(self.get_audio(), self.sample_rate, None)
+
+    def get_part_features(self):
+        return {}
+
+# Song features aggregated from the features of its parts, one entry per part of the song in
+# order (None for silent parts), with their durations in seconds and the sums of their absolute
+# amplitudes. Summaries are averaged weighted by the duration of the parts that have sound, the
+# entropy of the whole signal is recovered exactly from the parts' entropies and amplitude sums,
+# and the audio length factor comes from the length of the whole song.
+def aggregate_features(part_features, durations, amplitude_sums):
+    sounding = [i for i, features in enumerate(part_features) if features is not None]
+    if not sounding:
+        return None
+    part_weights = np.array([durations[i] for i in sounding], dtype=np.float64)
+    part_weights /= part_weights.sum()
+    features = {}
+    for name in FEATURE_NAMES:
+        features[name] = float(np.dot(part_weights, [part_features[i][name] for i in sounding]))
+    audio_length = sum(durations)
+    features['audio_length_factor'] = 1.0 if audio_length >= 30 else audio_length / 30
+    # H(song) = sum(w * H(part)) + H(w), w being each part's share of the total amplitude
+    shares = np.array([amplitude_sums[i] for i in sounding], dtype=np.float64)
+    shares /= shares.sum()
+    features['entropy'] = float(np.dot(shares, [part_features[i]['entropy'] for i in sounding]) + entropy(shares))
+    features['is_white_noise'] = bool(features['entropy'] > 8.0)
+    return features
+
+# Musicality features computed part by part while a song is mixed. Each part is analysed on a
+# background thread while the next one renders, and a part that comes back (a repeated chorus)
+# reuses the analysis of its first mix, so the finished song needs no analysis pass of its own.
+# With reuse_repeats=False every occurrence of a part is analysed (when repeats do not sound
+# the same, as in layer timelines, where tails carry over from the previous section) and the
+# features of a part aggregate its occurrences.
+class PartAnalyzer:
+    def __init__(self, sample_rate, analysis_sr=ANALYSIS_SAMPLE_RATE, res_type=ANALYSIS_RES_TYPE, tracer=None, reuse_repeats=True):
+        self.sample_rate = sample_rate
+        self.analysis_sr = analysis_sr
+        self.res_type = res_type
+        self.tracer = tracer
+        self.reuse_repeats = reuse_repeats
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        # Analysis jobs by part, or by occurrence without reuse_repeats
+        self.jobs = {}
+        self.results = None
+        # (part, duration in seconds, job key) in song order
+        self.parts = []
+
+    def add_part(self, part, samples):
+        key = part if self.reuse_repeats else len(self.parts)
+        self.parts.append((part, samples.shape[-1] / self.sample_rate, key))
+        if key not in self.jobs:
+            self.jobs[key] = self.pool.submit(tracing.call_in_span, self.tracer, 'score_part', {'part': part}, self.analyse, samples)
+
+    # Features and amplitude sum of a part mix; silent parts have no features
+    def analyse(self, samples):
+        y, sr = to_analysis_audio(samples, self.sample_rate, self.analysis_sr, self.res_type)
+        amplitude_sum = float(np.sum(np.abs(y)))
+        if amplitude_sum == 0:
+            return None, 0.0
+        return extract_features(y, sr), amplitude_sum
+
+    # Waits for the analysis of every part
+    def collect(self):
+        if self.results is None:
+            self.results = {key: job.result() for key, job in self.jobs.items()}
+            self.pool.shutdown()
+        return self.results
+
+    def get_part_features(self):
+        results = self.collect()
+        if self.reuse_repeats:
+            return {part: features for part, (features, amplitude_sum) in results.items()}
+        return {part: self.aggregate([entry for entry in self.parts if entry[0] == part])
+                for part in dict.fromkeys(part for part, duration, key in self.parts)}
+
+    def get_features(self):
+        return self.aggregate(self.parts)
+
+    # Features of some of the song's (part, duration, key) entries taken together
+    def aggregate(self, parts):
+        results = self.collect()
+        part_features = [results[key][0] for part, duration, key in parts]
+        amplitude_sums = [results[key][1] for part, duration, key in parts]
+        durations = [duration for part, duration, key in parts]
+        return aggregate_features(part_features, durations, amplitude_sums)
 
 if __name__ == '__main__':
     if len(sys.argv) < 2:
-      print('Usage: python musicality_measure.py <audio_file>')
+      print('Usage: python musicality_score.py <audio_file> [--draft]')
       sys.exit(1)
     
     filename=sys.argv[1]
-    # Define weights for each feature
-    tempo_weight = 0.05
-    spectral_contrast_weight = 0.05
-    chroma_feature_weight = 0.2
-    tonnetz_feature_weight = 0.05
-    zero_crossing_rate_weight = 0.02
-    mfcc_weight = 0.3
-    spectral_centroid_weight = 0.1
-    spectral_rolloff_weight = 0.1
-    rms_weight = 0.05
-    beat_sync_features_weight = 0.1
-    audio_length_weight = 0.1
-    entropy_weight = 0.1
-    musicality = calculate_musicality(filename, tempo_weight, spectral_contrast_weight, chroma_feature_weight, tonnetz_feature_weight, zero_crossing_rate_weight, mfcc_weight, spectral_centroid_weight, spectral_rolloff_weight, rms_weight, beat_sync_features_weight, audio_length_weight, entropy_weight)
-    print('Estimated musicality: {:.2f}'.format(musicality))
+    mode = 'draft' if '--draft' in sys.argv[2:] else 'full'
+    features = analyse_file(filename, mode)
+    if 'rejected' in features:
+        print('Rejected ({} mode): {}'.format(mode, features['rejected']))
+    else:
+        print('Estimated musicality ({} mode): {:.2f}'.format(mode, score_features(features)))
@@ -0,0 +1,44 @@
+import os
+import random
+
+# Chord and beat pattern files ("part: value, value, ...") are parsed once per process and
+# indexed by part name, including the "_roll" variants of the beat patterns. A file is parsed
+# again only when its modification time changes. Batch workers forked after the patterns are
+# loaded share the parsed library.
+
+_pattern_libraries = {}
+
+def parse_pattern_file(filename, convert=str):
+    patterns = {}
+    with open(filename, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                part, values = line.split(':')
+                pattern = tuple(convert(value.strip()) for value in values.split(','))
+                patterns.setdefault(part.strip(), []).append(pattern)
+    # Repeated lines are kept, so choosing uniformly from a part's tuple is weighted by
+    # how many times each pattern is listed in the file
+    return {part: tuple(part_patterns) for part, part_patterns in patterns.items()}
+
+def load_patterns(filename, convert=str):
+    mtime = os.stat(filename).st_mtime_ns
+    library_key = (os.path.abspath(filename), convert)
+    library = _pattern_libraries.get(library_key)
+    if library is None or library[0] != mtime:
+        library = (mtime, parse_pattern_file(filename, convert))
+        _pattern_libraries[library_key] = library
+    return library[1]
+
+def load_chord_patterns(filename):
+    return load_patterns(filename, str)
+
+def load_beat_patterns(filename):
+    return load_patterns(filename, int)
+
+# Constant time: a single draw from the part's patterns
+def choose_pattern(patterns, part, default, rng=random):
+    part_patterns = patterns.get(part)
+    if not part_patterns:
+        return default
+    return rng.choice(part_patterns)
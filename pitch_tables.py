@@ -0,0 +1,53 @@
+import json
+import os
+
+# MIDI pitches of every roman numeral chord in every key used by the generator, precomputed
+# with music21 and stored in pitch_table.json, so songs are generated with plain ints.
+# Regenerate the table with: python pitch_tables.py
+
+PITCH_TABLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pitch_table.json')
+
+# The keys of music_gen.generate_random_key and the numerals of chord_patterns.txt
+# (plus the default progression)
+KEYS = ['G', 'C', 'D', 'A', 'C#', 'F', 'Am', 'G#', 'Em', 'Bm', 'E', 'A#',
+        'A#m', 'Fm', 'F#', 'B', 'Gm', 'Dm', 'F#m', 'D#', 'Cm', 'C#m', 'G#m', 'D#m']
+ROMAN_NUMERALS = ['I', 'ii', 'IV', 'V', 'vi', 'vii']
+
+_pitch_table = None
+
+def roman_numeral_pitches(numeral, key):
+    from music21 import roman
+    return [p.midi for p in roman.RomanNumeral(numeral, key).pitches]
+
+def build_pitch_table(keys=KEYS, numerals=ROMAN_NUMERALS):
+    return {key: {numeral: roman_numeral_pitches(numeral, key) for numeral in numerals} for key in keys}
+
+def load_pitch_table():
+    global _pitch_table
+    if _pitch_table is None:
+        with open(PITCH_TABLE_FILE) as f:
+            _pitch_table = json.load(f)
+    return _pitch_table
+
+# MIDI pitches of a roman numeral chord in a key; pairs missing from the table
+# are worked out with music21 once and remembered
+def chord_pitches(key, numeral):
+    table = load_pitch_table()
+    key_table = table.setdefault(key, {})
+    if numeral not in key_table:
+        key_table[numeral] = roman_numeral_pitches(numeral, key)
+    return key_table[numeral]
+
+# Same pitch class in another octave (octave 4 starts at middle C, MIDI 60)
+def set_octave(midi_note, octave):
+    return (octave + 1) * 12 + midi_note % 12
+
+def save_pitch_table(table, filename=PITCH_TABLE_FILE):
+    # One line per key
+    key_lines = ['    ' + json.dumps(key) + ': ' + json.dumps(key_table) for key, key_table in table.items()]
+    with open(filename, 'w') as f:
+        f.write('{\n' + ',\n'.join(key_lines) + '\n}\n')
+
+if __name__ == '__main__':
+    save_pitch_table(build_pitch_table())
+    print('Pitch table saved as: ' + PITCH_TABLE_FILE)
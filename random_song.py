@@ -1,13 +1,14 @@
 from midiutil import MIDIFile
 from music21 import *
 from pydub import AudioSegment
-from midi2audio import FluidSynth
 from datetime import datetime
 import time
 import json
 import random
 import os
 import glob
+import wave
+import renderers
 
 def generate_chord_progression(key, tempo, time_signature, measures, name, part, pattern_file):
     # Create a MIDI file with one track
@@ -341,13 +342,18 @@ def get_levels(file_path):
         levels = json.load(f)
     return levels  
 
-def mix_and_save(harm_filename, bass_filename, melo_filename, beat_filename, name):
+def mix_and_save(harm_filename, bass_filename, melo_filename, beat_filename, name, renderer=None):
     song_arrangement = generate_song_arrangement()
     print("Song arrangement: "+ str(song_arrangement) + "\n")
     number_of_parts = len(song_arrangement)
-    song_parts = []
+    # The song is streamed to disk: every part is appended to the wav file as soon as it is mixed
+    song_file_wav = name + '.wav'
+    song_file_wav = os.path.join(name, song_file_wav)
+    song_file = None
     part_counter = 0
     soundfonts = {}
+    if renderer is None:
+        renderer = renderers.get_renderer()
     beat_soundfont = get_random_sound_font(str(os.path.join('sf','beat')))
     melody_soundfont = get_random_sound_font(str(os.path.join('sf','melody')))
     harmony_soundfont = get_random_sound_font(str(os.path.join('sf','harmony')))
@@ -368,88 +374,87 @@ def mix_and_save(harm_filename, bass_filename, melo_filename, beat_filename, nam
     print("Mixing song parts...")
     song_transitions = []
     song_time = 0
-    for part in song_arrangement:
-        this_transition = [part, song_time]
-        song_transitions.append(this_transition)
-        part_counter += 1
-        # part_idx_str = part + "-" + str(part_counter)
-        # song_transitions[part_idx_str] = song_time        
-        print("Mixing part: " + part + (' (' + str(part_counter) + ' of ' + str(number_of_parts) + ')'))        
-        # Render each MIDI file to an audio file using the chosen soundfont
-        beat_wav = 'beat' + "-" + part + "-" + str(part_counter) + ".wav"
-        beat_wav = os.path.join(name, beat_wav)
-        FluidSynth(beat_soundfont).midi_to_audio(beat_filename[part], beat_wav)
-        melo_wav = 'melody' + "-" + part + "-" + str(part_counter) + ".wav"
-        melo_wav = os.path.join(name, melo_wav)
-        FluidSynth(melody_soundfont).midi_to_audio(melo_filename[part], melo_wav)
-        harm_wav = 'harmony' + "-" + part + "-" + str(part_counter) + ".wav"
-        harm_wav = os.path.join(name, harm_wav)
-        FluidSynth(harmony_soundfont).midi_to_audio(harm_filename[part], harm_wav)
-        bass_wav = 'bassline' + "-" + part + "-" + str(part_counter) + ".wav"
-        bass_wav = os.path.join(name, bass_wav)
-        FluidSynth(bassline_soundfont).midi_to_audio(bass_filename[part], bass_wav)
-        # Load the rendered audio files
-        beat = AudioSegment.from_wav(beat_wav)
-        melody = AudioSegment.from_wav(melo_wav)
-        harmony = AudioSegment.from_wav(harm_wav)
-        bassline = AudioSegment.from_wav(bass_wav)
-        # TODO: volume and panning for each layer
-        beat.volume = float(levels[part]['beat']['volume'])
-        melody.volume = float(levels[part]['melody']['volume'])
-        harmony.volume = float(levels[part]['harmony']['volume'])
-        bassline.volume = float(levels[part]['bassline']['volume'])
-        beat.pan(float(levels[part]['beat']['panning']))
-        melody.pan(float(levels[part]['melody']['panning']))
-        harmony.pan(float(levels[part]['harmony']['panning']))
-        bassline.pan(float(levels[part]['bassline']['panning']))
-        # Mix the audio files together
-        beat_proba = float(inst_proba[part]['beat'])
-        melody_proba = float(inst_proba[part]['melody'])
-        harmony_proba = float(inst_proba[part]['harmony'])
-        bassline_proba = float(inst_proba[part]['bassline'])
-        # Create an empty AudioSegment to use as the initial mix
-        mix = AudioSegment.silent(duration=beat.duration_seconds*1000)
-        # Overlay each track onto the mix based on its probability value        
-        if random.random() <= beat_proba:
-            mix = mix.overlay(beat)
-            print("Beat added to mix: "+part)
-        if random.random() <= melody_proba:
-            mix = mix.overlay(melody)
-            print("Melody added to mix: "+part)
-        if random.random() <= harmony_proba:
-            mix = mix.overlay(harmony)
-            print("Harmony added to mix: "+part)
-        if random.random() <= bassline_proba:
-            mix = mix.overlay(bassline)
-            print("Bassline added to mix: "+part)
-
-        # Save the mixed audio to the output file
-        part_mix_file = name + '-' + str(part_counter) + '.wav';
-        part_mix_file = os.path.join(name, part_mix_file) 
-        mix.export(part_mix_file, format='wav')
-        song_parts.append(part_mix_file)
-        song_time = song_time + mix.duration_seconds
+    try:
+        for part in song_arrangement:
+            this_transition = [part, song_time]
+            song_transitions.append(this_transition)
+            part_counter += 1
+            # part_idx_str = part + "-" + str(part_counter)
+            # song_transitions[part_idx_str] = song_time        
+            print("Mixing part: " + part + (' (' + str(part_counter) + ' of ' + str(number_of_parts) + ')'))        
+            # Render each MIDI file to an audio file using the chosen soundfont
+            beat_wav = 'beat' + "-" + part + "-" + str(part_counter) + ".wav"
+            beat_wav = os.path.join(name, beat_wav)
+            renderer.render_to_file(beat_filename[part], beat_soundfont, beat_wav)
+            melo_wav = 'melody' + "-" + part + "-" + str(part_counter) + ".wav"
+            melo_wav = os.path.join(name, melo_wav)
+            renderer.render_to_file(melo_filename[part], melody_soundfont, melo_wav)
+            harm_wav = 'harmony' + "-" + part + "-" + str(part_counter) + ".wav"
+            harm_wav = os.path.join(name, harm_wav)
+            renderer.render_to_file(harm_filename[part], harmony_soundfont, harm_wav)
+            bass_wav = 'bassline' + "-" + part + "-" + str(part_counter) + ".wav"
+            bass_wav = os.path.join(name, bass_wav)
+            renderer.render_to_file(bass_filename[part], bassline_soundfont, bass_wav)
+            # Load the rendered audio files
+            beat = AudioSegment.from_wav(beat_wav)
+            melody = AudioSegment.from_wav(melo_wav)
+            harmony = AudioSegment.from_wav(harm_wav)
+            bassline = AudioSegment.from_wav(bass_wav)
+            # TODO: volume and panning for each layer
+            beat.volume = float(levels[part]['beat']['volume'])
+            melody.volume = float(levels[part]['melody']['volume'])
+            harmony.volume = float(levels[part]['harmony']['volume'])
+            bassline.volume = float(levels[part]['bassline']['volume'])
+            beat.pan(float(levels[part]['beat']['panning']))
+            melody.pan(float(levels[part]['melody']['panning']))
+            harmony.pan(float(levels[part]['harmony']['panning']))
+            bassline.pan(float(levels[part]['bassline']['panning']))
+            # Mix the audio files together
+            beat_proba = float(inst_proba[part]['beat'])
+            melody_proba = float(inst_proba[part]['melody'])
+            harmony_proba = float(inst_proba[part]['harmony'])
+            bassline_proba = float(inst_proba[part]['bassline'])
+            # Create an empty AudioSegment to use as the initial mix, in the format of the rendered
+            # layers (pydub's default silence is 11025 Hz mono)
+            mix = AudioSegment.silent(duration=beat.duration_seconds*1000, frame_rate=beat.frame_rate)
+            mix = mix.set_channels(beat.channels).set_sample_width(beat.sample_width)
+            # Overlay each track onto the mix based on its probability value        
+            if random.random() <= beat_proba:
+                mix = mix.overlay(beat)
+                print("Beat added to mix: "+part)
+            if random.random() <= melody_proba:
+                mix = mix.overlay(melody)
+                print("Melody added to mix: "+part)
+            if random.random() <= harmony_proba:
+                mix = mix.overlay(harmony)
+                print("Harmony added to mix: "+part)
+            if random.random() <= bassline_proba:
+                mix = mix.overlay(bassline)
+                print("Bassline added to mix: "+part)
+
+            # Append the mixed audio to the song file (its header is completed on close)
+            if song_file is None:
+                song_file = wave.open(song_file_wav, 'wb')
+                song_file.setnchannels(mix.channels)
+                song_file.setsampwidth(mix.sample_width)
+                song_file.setframerate(mix.frame_rate)
+            # Raw frames are appended as they are, so every part must match the header
+            mix = mix.set_frame_rate(song_file.getframerate()).set_channels(song_file.getnchannels()).set_sample_width(song_file.getsampwidth())
+            song_file.writeframes(mix.raw_data)
+            song_time = song_time + mix.duration_seconds
+    finally:
+        if song_file is not None:
+            song_file.close()
     
     # song_transitions['end'] = song_time
     this_transition = ['end', song_time]
     song_transitions.append(this_transition)
-    # Iterate through song_parts and concatenate them into a single file
-    song = AudioSegment.from_wav(song_parts[0])
-    for part_wav in song_parts[1:]:
-        song += AudioSegment.from_wav(part_wav)
-    # Save the song as a wav file
-    song_file_wav = name + '.wav'
-    song_file_wav = os.path.join(name, song_file_wav)
-    song.export(song_file_wav, format='wav')
     print("Song saved as: " + song_file_wav)
-    # Clean the wav parts
-    for part_wav in song_parts:
-        os.remove(part_wav)
         
     return song_file_wav, song_arrangement, song_transitions, soundfonts
 
 
-def create_song(key, tempo, time_signature, measures, name, chord_pat_file, beat_pat_file):
+def create_song(key, tempo, time_signature, measures, name, chord_pat_file, beat_pat_file, renderer=None):
     song_info = {}
     song_info['key'] = key
     song_info['tempo'] = tempo
@@ -467,7 +472,7 @@ def create_song(key, tempo, time_signature, measures, name, chord_pat_file, beat
     start_time = time.time()
     
     ha, ba, me, be = generate_song_parts(key, tempo, time_signature, measures, song_name, chord_pat_file, beat_pat_file)
-    wav_name, arrangement, transitions, soundfonts = mix_and_save(ha, ba, me, be, song_name)
+    wav_name, arrangement, transitions, soundfonts = mix_and_save(ha, ba, me, be, song_name, renderer)
     
     end_time = time.time()
     
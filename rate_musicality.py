@@ -1,127 +1,238 @@
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import os
 import sys
-import librosa
-import numpy as np
-from scipy.stats import entropy
-
-if __name__ == '__main__':
-    if len(sys.argv) < 2:
-      print('Usage: python musicality_measure.py <audio_file>')
-      sys.exit(1)
-    
-    filename=sys.argv[1]
-
-# Define weights for each feature
-tempo_weight = 0.05
-spectral_contrast_weight = 0.05
-chroma_feature_weight = 0.2
-tonnetz_feature_weight = 0.05
-zero_crossing_rate_weight = 0.02
-mfcc_weight = 0.3
-spectral_centroid_weight = 0.1
-spectral_rolloff_weight = 0.1
-rms_weight = 0.05
-beat_sync_features_weight = 0.1
-audio_length_weight = 0.1
-entropy_weight = 0.1
-
-try:
-    # Load the audio file
-    y, sr = librosa.load(filename)
-
-    # Calculate the Tempo
-    tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
-
-    # Calculate the Spectral Contrast
-    spectral_contrast = librosa.feature.spectral_contrast(y=y, sr=sr)
-
-    # Calculate the Chroma Feature
-    chroma_feature = librosa.feature.chroma_stft(y=y, sr=sr)
-
-    # Calculate the Tonnetz Feature
-    tonnetz_feature = librosa.feature.tonnetz(y=y, sr=sr)
-
-    # Calculate the Zero Crossing Rate
-    zero_crossing_rate = librosa.feature.zero_crossing_rate(y=y)
-
-    # Calculate the MFCCs
-    mfcc = librosa.feature.mfcc(y=y, sr=sr)
-
-    # Calculate the Spectral Centroid
-    spectral_centroid = librosa.feature.spectral_centroid(y=y, sr=sr)
-
-    # Calculate the Spectral Rolloff
-    spectral_rolloff = librosa.feature.spectral_rolloff(y=y, sr=sr)
-
-    # Calculate the RMS Energy
-    rms = librosa.feature.rms(y=y)
-
-    # Calculate the Beat Sync Features
-    tempo, beats = librosa.beat.beat_track(y=y, sr=sr)
-    beat_sync_features = librosa.util.sync(y, beats)
-
-    # Normalize the features
-    tempo = (tempo - 40) / (240 - 40)
-    tempo = 1 - abs(tempo - 0.5)
-
-    spectral_contrast = (spectral_contrast - np.min(spectral_contrast)) / (np.max(spectral_contrast) - np.min(spectral_contrast))
-    chroma_feature = (chroma_feature - np.min(chroma_feature)) / (np.max(chroma_feature) - np.min(chroma_feature))
-    tonnetz_feature = (tonnetz_feature - np.min(tonnetz_feature)) / (np.max(tonnetz_feature) - np.min(tonnetz_feature))
-    zero_crossing_rate = (zero_crossing_rate - np.min(zero_crossing_rate)) / (np.max(zero_crossing_rate) - np.min(zero_crossing_rate))
-    mfcc = (mfcc - np.min(mfcc)) / (np.max(mfcc) - np.min(mfcc))
-    spectral_centroid = (spectral_centroid - np.min(spectral_centroid)) / (np.max(spectral_centroid) - np.min(spectral_centroid))
-    spectral_rolloff = (spectral_rolloff - np.min(spectral_rolloff)) / (np.max(spectral_rolloff) - np.min(spectral_rolloff))
-    rms = (rms - np.min(rms)) / (np.max(rms) - np.min(rms))
-    beat_sync_features = (beat_sync_features - np.min(beat_sync_features)) / (np.max(beat_sync_features) - np.min(beat_sync_features))
-
-    # Calculate audio length factor
-    audio_length = librosa.get_duration(y=y, sr=sr)
-    audio_length_factor = 1.0 if audio_length >= 30 else audio_length / 30
-
-    # Calculate probability distribution and entropy
-    prob_distribution = np.abs(y) / np.sum(np.abs(y))
-    entropy_value = entropy(prob_distribution)
-
-    # Check for white noise
-    is_white_noise = entropy_value > 8.0
-
-    # Calculate the musicality based on the extracted features and their weights
-    musicality = (
-        np.mean(tempo) * tempo_weight +
-        np.mean(spectral_contrast) * spectral_contrast_weight +
-        np.mean(chroma_feature) * chroma_feature_weight +
-        np.mean(tonnetz_feature) * tonnetz_feature_weight +
-        np.mean(zero_crossing_rate) * zero_crossing_rate_weight +
-        np.mean(mfcc) * mfcc_weight +
-        np.mean(spectral_centroid) * spectral_centroid_weight +
-        np.mean(spectral_rolloff) * spectral_rolloff_weight +
-        np.mean(rms) * rms_weight +
-        np.mean(beat_sync_features) * beat_sync_features_weight +
-        audio_length_factor * audio_length_weight -
-        entropy_value * entropy_weight -
-        (0.5 if is_white_noise else 0.0)
-    )
-    
-    # Normalize the musicality value
-    musicality_value = (musicality * -1)
-    musicality_value = musicality_value - 1
-
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import musicality_score
+
+# Rate the musicality of audio files
+#
+# Usage: python rate_musicality.py <audio_file> [--timing]         (detailed report)
+#        python rate_musicality.py <dir|glob|file>... --output scores.jsonl [--workers 8]
+#
+# In batch mode the feature statistics of every file are cached by content hash, so
+# rescoring an unchanged corpus only reads the files to hash them
+
+AUDIO_EXTENSIONS = ('.wav', '.flac', '.ogg', '.mp3')
+CACHE_DIR = '.musicality_cache'
+# Bump when the extracted features change, so old cache entries are recomputed
+FEATURES_VERSION = 2
+
+REPORT_LABELS = [('Tempo', 'tempo'), ('Spectral Contrast', 'spectral_contrast'), ('Chroma Feature', 'chroma_feature'),
+                 ('Tonnetz Feature', 'tonnetz_feature'), ('Zero Crossing Rate', 'zero_crossing_rate'), ('MFCCs', 'mfcc'),
+                 ('Spectral Centroid', 'spectral_centroid'), ('Spectral Rolloff', 'spectral_rolloff'), ('RMS Energy', 'rms'),
+                 ('Beat Sync Features', 'beat_sync_features'), ('Audio Length', 'audio_length_factor'), ('Entropy', 'entropy')]
+
+def print_report(filename, features, weights=musicality_score.DEFAULT_WEIGHTS):
     print('Measuring musicality for audio file: {}\n'.format(filename))
 
     # Print the parameters and their weights
-    print('Tempo: {:.2f} (weight: {:.2f})'.format(np.mean(tempo), tempo_weight))
-    print('Spectral Contrast: {:.2f} (weight: {:.2f})'.format(np.mean(spectral_contrast), spectral_contrast_weight))
-    print('Chroma Feature: {:.2f} (weight: {:.2f})'.format(np.mean(chroma_feature), chroma_feature_weight))
-    print('Tonnetz Feature: {:.2f} (weight: {:.2f})'.format(np.mean(tonnetz_feature), tonnetz_feature_weight))
-    print('Zero Crossing Rate: {:.2f} (weight: {:.2f})'.format(np.mean(zero_crossing_rate), zero_crossing_rate_weight))
-    print('MFCCs: {:.2f} (weight: {:.2f})'.format(np.mean(mfcc), mfcc_weight))
-    print('Spectral Centroid: {:.2f} (weight: {:.2f})'.format(np.mean(spectral_centroid), spectral_centroid_weight))
-    print('Spectral Rolloff: {:.2f} (weight: {:.2f})'.format(np.mean(spectral_rolloff), spectral_rolloff_weight))
-    print('RMS Energy: {:.2f} (weight: {:.2f})'.format(np.mean(rms), rms_weight))
-    print('Beat Sync Features: {:.2f} (weight: {:.2f})'.format(np.mean(beat_sync_features), beat_sync_features_weight))
-    print('Audio Length: {:.2f} (weight: {:.2f})'.format(audio_length_factor, audio_length_weight))
-    print('Entropy: {:.2f} (weight: {:.2f})'.format(entropy_value, entropy_weight))
-    # Print the musicality value
-    print('\nEstimated musicality: {:.2f}'.format(musicality_value))
-
-except Exception as e:
-    print(f'Error processing audio file: {e}')
+    for label, name in REPORT_LABELS:
+        if name in features:
+            print('{}: {:.2f} (weight: {:.2f})'.format(label, features[name], weights[name]))
+        else:
+            print('{}: not computed (weight: {:.2f})'.format(label, weights[name]))
+    # Print the musicality value (rejected audio has none)
+    mode = features.get('analysis_mode', 'full')
+    if 'rejected' in features:
+        print('\nRejected ({} mode): {}'.format(mode, features['rejected']))
+    else:
+        print('\nEstimated musicality ({} mode): {:.2f}'.format(mode, musicality_score.score_features(features, weights)))
+
+# Wall and CPU time of every analysis step (musicality_score.timed) with its share of the
+# total wall time, slowest first
+def timing_report(timings):
+    total_wall = sum(step['wall'] for step in timings.values())
+    total_cpu = sum(step['cpu'] for step in timings.values())
+    steps = []
+    for name, step in sorted(timings.items(), key=lambda item: item[1]['wall'], reverse=True):
+        share = step['wall'] / total_wall if total_wall > 0 else 0.0
+        steps.append({'name': name, 'wall': step['wall'], 'cpu': step['cpu'], 'share': share})
+    return {'total': {'wall': total_wall, 'cpu': total_cpu}, 'steps': steps}
+
+# Step timings of many files added up
+def merge_timings(timings_list):
+    merged = {}
+    for timings in timings_list:
+        for name, step in timings.items():
+            merged_step = merged.setdefault(name, {'wall': 0.0, 'cpu': 0.0})
+            merged_step['wall'] += step['wall']
+            merged_step['cpu'] += step['cpu']
+    return merged
+
+def print_timing(report, file=sys.stdout):
+    print('\n{:<20} {:>10} {:>10} {:>7}'.format('Step', 'Wall (ms)', 'CPU (ms)', 'Share'), file=file)
+    for step in report['steps']:
+        print('{:<20} {:>10.1f} {:>10.1f} {:>6.1f}%'.format(step['name'], step['wall'] * 1000, step['cpu'] * 1000, step['share'] * 100), file=file)
+    print('{:<20} {:>10.1f} {:>10.1f}'.format('Total', report['total']['wall'] * 1000, report['total']['cpu'] * 1000), file=file)
+
+# Audio files named on the command line: files, directories (searched recursively) or glob patterns
+def find_audio_files(inputs):
+    files = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                files += [os.path.join(root, name) for name in names if name.lower().endswith(AUDIO_EXTENSIONS)]
+        elif os.path.isfile(path):
+            files.append(path)
+        else:
+            files += [match for match in glob.glob(path, recursive=True) if match.lower().endswith(AUDIO_EXTENSIONS)]
+    return sorted(set(files))
+
+def file_hash(filename):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Cache entry of a file analysed with some settings: full analyses are keyed by the content
+# hash alone, other modes and feature subsets get their own entries
+def cache_key(digest, mode='full', feature_names=None):
+    key = digest
+    if mode != 'full':
+        key += '-' + mode
+    if feature_names is not None:
+        key += '-' + '+'.join(sorted(feature_names))
+    return key
+
+def load_cached_features(cache_dir, digest):
+    try:
+        with open(os.path.join(cache_dir, digest + '.json')) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if entry.get('version') != FEATURES_VERSION:
+        return None
+    return entry['features']
+
+def save_cached_features(cache_dir, digest, features):
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_file = os.path.join(cache_dir, digest + '.json')
+    # Written under a temporary name and renamed, so workers never read a partial entry
+    temp_file = cache_file + '.' + str(os.getpid()) + '.tmp'
+    with open(temp_file, 'w') as f:
+        json.dump({'version': FEATURES_VERSION, 'features': features}, f)
+    os.replace(temp_file, cache_file)
+
+# Feature statistics of a file, from the cache when its content has been analysed before
+# (unless the analysis is being timed, with timings as in musicality_score.extract_features)
+def get_file_features(filename, cache_dir=CACHE_DIR, mode='full', feature_names=None, timings=None):
+    if cache_dir is None:
+        return None, musicality_score.analyse_file(filename, mode, feature_names, timings), False
+    digest = file_hash(filename)
+    key = cache_key(digest, mode, feature_names)
+    features = load_cached_features(cache_dir, key) if timings is None else None
+    if features is not None:
+        return digest, features, True
+    features = musicality_score.analyse_file(filename, mode, feature_names, timings)
+    save_cached_features(cache_dir, key, features)
+    return digest, features, False
+
+def rate_file(filename, cache_dir=CACHE_DIR, mode='full', feature_names=None, timing=False):
+    timings = {} if timing else None
+    digest, features, cached = get_file_features(filename, cache_dir, mode, feature_names, timings)
+    score = musicality_score.score_features(features) if 'rejected' not in features else None
+    result = {'file': filename, 'sha256': digest, 'cached': cached, 'musicality_score': score, 'rejected': None}
+    result.update(features)
+    if timing:
+        result['timings'] = timings
+    return result
+
+def rate_files(files, workers, cache_dir=CACHE_DIR, mode='full', feature_names=None, timing=False):
+    results = []
+    failures = []
+    if workers <= 1:
+        for filename in files:
+            try:
+                results.append(rate_file(filename, cache_dir, mode, feature_names, timing))
+            except Exception as e:
+                print(f'Error processing audio file {filename}: {e}', file=sys.stderr)
+                failures.append(filename)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(rate_file, filename, cache_dir, mode, feature_names, timing): filename for filename in files}
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    print(f'Error processing audio file {futures[future]}: {e}', file=sys.stderr)
+                    failures.append(futures[future])
+    # Same order as the input, whatever order the workers finish in
+    results.sort(key=lambda result: result['file'])
+    return results, failures
+
+def write_results(results, output=None, output_format=None):
+    if output_format is None:
+        output_format = 'csv' if output is not None and output.lower().endswith('.csv') else 'jsonl'
+    f = open(output, 'w', newline='') if output is not None else sys.stdout
+    try:
+        if output_format == 'csv':
+            if results:
+                # Draft results may skip some features
+                fieldnames = list(dict.fromkeys(name for result in results for name in result))
+                writer = csv.DictWriter(f, fieldnames=fieldnames)
+                writer.writeheader()
+                writer.writerows(results)
+        else:
+            for result in results:
+                f.write(json.dumps(result) + '\n')
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Rate the musicality of audio files')
+    parser.add_argument('inputs', nargs='+', help='audio files, directories or glob patterns')
+    parser.add_argument('--output', default=None, help='results file (default: standard output)')
+    parser.add_argument('--format', choices=['jsonl', 'csv'], default=None,
+                        help='results format (default: from the output extension, otherwise jsonl)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes (default: CPU count)')
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help='feature cache directory (default: ' + CACHE_DIR + ')')
+    parser.add_argument('--no-cache', action='store_true', help='always analyse the files')
+    parser.add_argument('--draft', action='store_true',
+                        help='fast screening scores: lower sample rate, larger hops, fewer features, silence and white noise rejected early')
+    parser.add_argument('--features', default=None,
+                        help='comma separated features to compute (default: all, or the draft subset with --draft)')
+    parser.add_argument('--timing', action='store_true',
+                        help='time every analysis step (files are analysed even if cached) and print the breakdown')
+    parser.add_argument('--timing-output', default=None, help='write the timing breakdown as JSON to this file')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    cache_dir = None if args.no_cache else args.cache_dir
+    mode = 'draft' if args.draft else 'full'
+    feature_names = args.features.split(',') if args.features else None
+    timing = args.timing or args.timing_output is not None
+    report = None
+    if len(args.inputs) == 1 and os.path.isfile(args.inputs[0]) and args.output is None and args.format is None:
+        # A single file: detailed report
+        filename = args.inputs[0]
+        try:
+            timings = {} if timing else None
+            digest, features, cached = get_file_features(filename, cache_dir, mode, feature_names, timings)
+            print_report(filename, features)
+            if timing:
+                report = timing_report(timings)
+                report['file'] = filename
+                print_timing(report)
+        except Exception as e:
+            print(f'Error processing audio file: {e}')
+    else:
+        files = find_audio_files(args.inputs)
+        results, failures = rate_files(files, args.workers, cache_dir, mode, feature_names, timing)
+        write_results(results, args.output, args.format)
+        cached = sum(1 for result in results if result['cached'])
+        print(f'Rated {len(results)} file(s) ({cached} from cache, {len(failures)} failed)', file=sys.stderr)
+        if timing:
+            # Steps added up over every file
+            report = timing_report(merge_timings(result['timings'] for result in results))
+            report['files'] = len(results)
+            print_timing(report, sys.stderr)
+    if report is not None and args.timing_output is not None:
+        with open(args.timing_output, 'w') as f:
+            json.dump(report, f, indent=4)
@@ -0,0 +1,120 @@
+import os
+import tempfile
+import numpy as np
+from midi2audio import FluidSynth
+from pedalboard.io import AudioFile
+
+# pyfluidsynth is optional: without it the FluidSynth command line is used
+try:
+    import fluidsynth
+except ImportError:
+    fluidsynth = None
+
+SAMPLE_RATE = 44100
+
+# Renderers turn a MIDI file into audio using a soundfont. They share the same interface:
+#   render(midi_file, soundfont, scratch_dir=None) -> float32 array shaped (channels, frames)
+#   render_to_file(midi_file, soundfont, wav_file) -> wav_file
+# Audio arrays use the (channels, frames) layout expected by pedalboard.
+
+def read_audio(wav_file):
+    with AudioFile(wav_file) as af:
+        return af.read(af.frames), af.samplerate
+
+def write_audio(wav_file, samples, sample_rate):
+    with open_audio_writer(wav_file, sample_rate, samples.shape[0]) as of:
+        of.write(samples)
+    return wav_file
+
+# Audio file opened for writing in blocks: call write(samples) as many times as needed;
+# the header is completed when the file is closed
+def open_audio_writer(wav_file, sample_rate, channels=2):
+    return AudioFile(wav_file, 'w', sample_rate, channels)
+
+# Spawns a fluidsynth process per file (the original midi2audio path)
+class SubprocessRenderer:
+    name = 'subprocess'
+
+    def __init__(self, sample_rate=SAMPLE_RATE):
+        self.sample_rate = sample_rate
+
+    def render_to_file(self, midi_file, soundfont, wav_file):
+        FluidSynth(soundfont, self.sample_rate).midi_to_audio(midi_file, wav_file)
+        return wav_file
+
+    def render(self, midi_file, soundfont, scratch_dir=None):
+        # The command line can only write files, so go through a temporary WAV in scratch_dir
+        # (the song's workspace; the system temporary directory by default)
+        fd, wav_file = tempfile.mkstemp(suffix='.wav', dir=scratch_dir)
+        os.close(fd)
+        try:
+            self.render_to_file(midi_file, soundfont, wav_file)
+            samples, _ = read_audio(wav_file)
+        finally:
+            os.remove(wav_file)
+        return samples
+
+    def close(self):
+        pass
+
+# Keeps one synth per soundfont loaded in this process and renders straight to memory
+class InProcessRenderer:
+    name = 'inprocess'
+
+    def __init__(self, sample_rate=SAMPLE_RATE, gain=0.2, block_size=4096):
+        if fluidsynth is None:
+            raise RuntimeError('pyfluidsynth is not available')
+        self.sample_rate = sample_rate
+        self.gain = gain
+        self.block_size = block_size
+        self.synths = {}
+
+    def get_synth(self, soundfont):
+        if soundfont not in self.synths:
+            # Advance the MIDI player by rendered samples instead of the wall clock
+            settings = {'player.timing-source': 'sample', 'synth.lock-memory': 0}
+            synth = fluidsynth.Synth(gain=self.gain, samplerate=self.sample_rate, **settings)
+            if synth.sfload(soundfont, update_midi_preset=1) == fluidsynth.FLUID_FAILED:
+                synth.delete()
+                raise RuntimeError('Could not load soundfont: ' + soundfont)
+            self.synths[soundfont] = synth
+        return self.synths[soundfont]
+
+    def render(self, midi_file, soundfont, scratch_dir=None):
+        synth = self.get_synth(soundfont)
+        # Start every file from silence with the default programs
+        synth.system_reset()
+        if synth.play_midi_file(midi_file) == fluidsynth.FLUID_FAILED:
+            raise RuntimeError('Could not play MIDI file: ' + midi_file)
+        blocks = []
+        while fluidsynth.fluid_player_get_status(synth.player) == fluidsynth.FLUID_PLAYER_PLAYING:
+            blocks.append(synth.get_samples(self.block_size))
+        synth.play_midi_stop()
+        # Interleaved 16-bit stereo -> float32 (channels, frames)
+        samples = np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.int16)
+        return (samples.reshape(-1, 2).T / 32768.0).astype(np.float32)
+
+    def render_to_file(self, midi_file, soundfont, wav_file):
+        return write_audio(wav_file, self.render(midi_file, soundfont), self.sample_rate)
+
+    def close(self):
+        for synth in self.synths.values():
+            synth.delete()
+        self.synths = {}
+
+renderer_backends = {
+    'subprocess': SubprocessRenderer,
+    'inprocess': InProcessRenderer,
+}
+
+# Renderers are shared per process, so soundfonts stay loaded across songs in a batch
+_renderers = {}
+
+def get_renderer(backend='auto'):
+    if backend == 'auto':
+        backend = 'inprocess' if fluidsynth is not None else 'subprocess'
+    if backend not in renderer_backends:
+        raise ValueError('Unknown renderer backend: ' + str(backend))
+    if backend not in _renderers:
+        _renderers[backend] = renderer_backends[backend]()
+    return _renderers[backend]
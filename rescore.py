@@ -0,0 +1,101 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import musicality_score
+import rate_musicality
+
+# Rescore songs with new feature weights, from the feature summaries stored in their JSON
+# annotations (music_gen.create_song) or in the results of rate_musicality.py, without
+# analysing any audio: all the scores come from one matrix-vector product
+#
+# Usage: python rescore.py <dir|glob|file>... [--weights weights.json] [--weight mfcc=0.4 ...] [--top 20]
+
+FEATURE_FILE_EXTENSIONS = ('.json', '.jsonl')
+
+def find_feature_files(inputs):
+    files = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                files += [os.path.join(root, name) for name in names if name.lower().endswith(FEATURE_FILE_EXTENSIONS)]
+        elif os.path.isfile(path):
+            files.append(path)
+        else:
+            files += [match for match in glob.glob(path, recursive=True) if match.lower().endswith(FEATURE_FILE_EXTENSIONS)]
+    return sorted(set(files))
+
+# Any feature summary can be rescored: features that a draft analysis or a --features subset
+# skipped count as 0 (see musicality_score.feature_matrix). Rejected audio has no score.
+def has_features(entry):
+    return not entry.get('rejected') and any(name in entry for name in musicality_score.FEATURE_NAMES)
+
+# Song names and feature summaries: song annotations keep them under 'musicality_features',
+# rate_musicality.py results (JSON Lines) keep them next to the file name. Entries without
+# features (rejected or silent songs) are counted in skipped.
+def load_feature_sets(files):
+    names = []
+    feature_sets = []
+    skipped = 0
+    for filename in files:
+        with open(filename) as f:
+            if filename.lower().endswith('.jsonl'):
+                entries = [json.loads(line) for line in f if line.strip()]
+            else:
+                entries = [json.load(f)]
+        for entry in entries:
+            if not isinstance(entry, dict):
+                continue
+            features = entry.get('musicality_features', entry)
+            if isinstance(features, dict) and has_features(features):
+                names.append(entry.get('file_name', entry.get('file', filename)))
+                feature_sets.append(features)
+            else:
+                skipped += 1
+    return names, feature_sets, skipped
+
+# Weights from a JSON file and/or name=value pairs; the others keep their default
+def load_weights(weights_file=None, weight_args=()):
+    weights = dict(musicality_score.DEFAULT_WEIGHTS)
+    if weights_file is not None:
+        with open(weights_file) as f:
+            weights.update(json.load(f))
+    for weight_arg in weight_args:
+        name, value = weight_arg.split('=')
+        weights[name.strip()] = float(value)
+    unknown = set(weights) - set(musicality_score.FEATURE_NAMES)
+    if unknown:
+        raise ValueError('Unknown features: ' + ', '.join(sorted(unknown)))
+    return weights
+
+# Songs sorted from the highest score down
+def rank(names, scores):
+    order = scores.argsort()[::-1]
+    return [{'rank': position + 1, 'file': names[i], 'musicality_score': float(scores[i])} for position, i in enumerate(order)]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Rescore songs with new weights from their stored features')
+    parser.add_argument('inputs', nargs='+', help='song JSON files, rate_musicality.py JSON Lines results, directories or glob patterns')
+    parser.add_argument('--weights', default=None, help='JSON file with feature weights')
+    parser.add_argument('--weight', action='append', default=[], metavar='FEATURE=VALUE', help='set one weight (repeatable)')
+    parser.add_argument('--top', type=int, default=None, help='only output the best N songs')
+    parser.add_argument('--output', default=None, help='ranking file (default: standard output)')
+    parser.add_argument('--format', choices=['jsonl', 'csv'], default=None,
+                        help='ranking format (default: from the output extension, otherwise jsonl)')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    weights = load_weights(args.weights, args.weight)
+    names, feature_sets, skipped = load_feature_sets(find_feature_files(args.inputs))
+    if skipped:
+        print(f'Skipped {skipped} entr{"y" if skipped == 1 else "ies"} without features (rejected or silent audio)', file=sys.stderr)
+    start_time = time.time()
+    matrix, white_noise = musicality_score.feature_matrix(feature_sets)
+    scores = musicality_score.score_feature_matrix(matrix, white_noise, weights)
+    elapsed_time = time.time() - start_time
+    ranking = rank(names, scores)[:args.top]
+    rate_musicality.write_results(ranking, args.output, args.format)
+    print(f'Rescored {len(names)} song(s) in {elapsed_time * 1000:.2f} ms', file=sys.stderr)
@@ -0,0 +1,75 @@
+import glob
+import os
+import random
+import shutil
+import sys
+import zlib
+import numpy as np
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+import music_gen
+import renderers
+
+LAYERS = ['beat', 'melody', 'harmony', 'bassline']
+# Two measures per part keep the song short
+MEASURES = {'intro': 2, 'verse': 2, 'chorus': 2, 'bridge': 2, 'outro': 2}
+
+# Renders a loud tone picked from the contents of the MIDI file, the same on disk and in memory
+# (in memory, the audio goes through a 16-bit file too, as it does from FluidSynth)
+class ToneRenderer:
+    sample_rate = renderers.SAMPLE_RATE
+
+    def tone(self, midi_file):
+        with open(midi_file, 'rb') as f:
+            frequency = 110 + zlib.crc32(f.read()) % 440
+        t = np.arange(2 * self.sample_rate) / self.sample_rate
+        x = (0.9 * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+        return np.stack([x, x])
+
+    def render_to_file(self, midi_file, soundfont, wav_file):
+        return renderers.write_audio(wav_file, self.tone(midi_file), self.sample_rate)
+
+    def render(self, midi_file, soundfont, scratch_dir=None):
+        wav_file = midi_file + '.wav'
+        self.render_to_file(midi_file, soundfont, wav_file)
+        samples, _ = renderers.read_audio(wav_file)
+        os.remove(wav_file)
+        return samples
+
+# Config files and an (unused) soundfont per layer in a working directory of its own
+def make_workdir(path):
+    os.makedirs(path)
+    for pattern in ('*.json', '*.txt'):
+        for config_file in glob.glob(os.path.join(REPO_DIR, pattern)):
+            shutil.copy(config_file, path)
+    for layer in LAYERS:
+        os.makedirs(os.path.join(path, 'sf', layer))
+        open(os.path.join(path, 'sf', layer, 'tone.sf2'), 'wb').close()
+
+def mix_song(workdir, seed, in_memory, layer_timelines):
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        rng = random.Random(seed)
+        name = 'song'
+        os.makedirs(name)
+        ha, ba, me, be, du = music_gen.generate_song_parts('C', 120, '4/4', MEASURES, name, 'chord_patterns.txt', 'beat_patterns.txt', rng)
+        song_files = music_gen.mix_and_save(ha, ba, me, be, du, name, ToneRenderer(), in_memory, rng=rng,
+                                            layer_timelines=layer_timelines)[0]
+        samples, _ = renderers.read_audio(song_files['wav'])
+    finally:
+        os.chdir(cwd)
+    return samples
+
+@pytest.mark.parametrize('layer_timelines', [False, True])
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_in_memory_mix_matches_disk(tmp_path, seed, layer_timelines):
+    make_workdir(tmp_path / 'disk')
+    make_workdir(tmp_path / 'memory')
+    on_disk = mix_song(tmp_path / 'disk', seed, False, layer_timelines)
+    in_memory = mix_song(tmp_path / 'memory', seed, True, layer_timelines)
+    assert on_disk.shape == in_memory.shape
+    # Layers processed on disk are rounded to 16 bits, so only a few steps of difference remain
+    assert np.max(np.abs(on_disk - in_memory)) < 8 / 32768
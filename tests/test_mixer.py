@@ -0,0 +1,31 @@
+import os
+import sys
+import numpy as np
+import pytest
+from pydub import AudioSegment
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import mixer
+
+# A stereo 16-bit segment holding a constant value on both channels
+def constant_segment(value, frames=1000):
+    samples = np.full(frames * 2, value, dtype='<i2')
+    return AudioSegment(samples.tobytes(), frame_rate=44100, sample_width=2, channels=2)
+
+@pytest.mark.parametrize('pan', [-1.0, -0.6, -0.2, 0.0, 0.1, 0.2, 0.5, 1.0])
+def test_pan_gains_match_pydub(pan):
+    value = 10000
+    panned = constant_segment(value).pan(pan)
+    samples = np.array(panned.get_array_of_samples()).reshape(-1, 2)
+    pydub_gains = samples[0] / value
+    assert mixer.pan_gains(pan) == pytest.approx(tuple(pydub_gains), abs=2 / value)
+
+def test_mix_layer_pans_like_pydub():
+    value = 10000
+    volume = 0.8
+    pan = -0.3
+    mix = mixer.create_mix_buffer(1000)
+    layer = np.full((2, 1000), value / 32768, dtype=np.float32)
+    mixer.mix_layer(mix, layer, volume, pan)
+    expected = np.array(constant_segment(value).pan(pan).get_array_of_samples()).reshape(-1, 2).T / 32768 * volume
+    assert np.allclose(mix, expected, atol=2 / 32768)
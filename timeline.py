@@ -0,0 +1,141 @@
+import struct
+import numpy as np
+from midiutil import MIDIFile
+from pedalboard.io import AudioFile
+
+# Continuous layer timelines: instead of rendering every (part, layer) on its own, the MIDI
+# files of a layer's parts are laid out one after the other in the song arrangement and
+# rendered in a single pass, so reverb and release tails carry over section boundaries and a
+# song needs one synth run per layer. Sections where the layer is left out of the mix are
+# muted by leaving their notes out.
+
+# Notes of a MIDI file as (channel, pitch, start, duration, velocity), times in beats, and the
+# tempo (BPM) of its first tempo event (120 if there is none)
+def read_midi_notes(midi_file):
+    with open(midi_file, 'rb') as f:
+        data = f.read()
+    if data[:4] != b'MThd':
+        raise ValueError('Not a MIDI file: ' + midi_file)
+    header_length, file_format, track_count, division = struct.unpack('>IHHH', data[4:14])
+    if division & 0x8000:
+        raise ValueError('SMPTE time division is not supported: ' + midi_file)
+    position = 8 + header_length
+    tempo = None
+    notes = []
+    for track in range(track_count):
+        chunk_id, chunk_length = struct.unpack('>4sI', data[position:position + 8])
+        position += 8
+        if chunk_id == b'MTrk':
+            track_tempo, track_notes = read_track(data[position:position + chunk_length], division)
+            if tempo is None:
+                tempo = track_tempo
+            notes += track_notes
+        position += chunk_length
+    notes.sort(key=lambda note: (note[2], note[0], note[1]))
+    return (tempo if tempo is not None else 120.0), notes
+
+def read_variable_length(data, position):
+    value = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value = (value << 7) | (byte & 0x7f)
+        if not byte & 0x80:
+            return value, position
+
+def read_track(data, division):
+    position = 0
+    tick = 0
+    status = None
+    tempo = None
+    notes = []
+    # Notes still sounding, by (channel, pitch): (start tick, velocity), first in first out
+    sounding = {}
+    while position < len(data):
+        delta, position = read_variable_length(data, position)
+        tick += delta
+        if data[position] & 0x80:
+            status = data[position]
+            position += 1
+        if status == 0xff:
+            meta_type = data[position]
+            length, position = read_variable_length(data, position + 1)
+            if meta_type == 0x51 and tempo is None:
+                tempo = 60000000 / int.from_bytes(data[position:position + 3], 'big')
+            position += length
+        elif status in (0xf0, 0xf7):
+            length, position = read_variable_length(data, position)
+            position += length
+        else:
+            kind = status & 0xf0
+            channel = status & 0x0f
+            if kind in (0xc0, 0xd0):
+                position += 1
+                continue
+            pitch, velocity = data[position], data[position + 1]
+            position += 2
+            if kind == 0x90 and velocity > 0:
+                sounding.setdefault((channel, pitch), []).append((tick, velocity))
+            elif kind == 0x80 or kind == 0x90:
+                started = sounding.get((channel, pitch))
+                if started:
+                    start, start_velocity = started.pop(0)
+                    notes.append((channel, pitch, start / division, (tick - start) / division, start_velocity))
+    return tempo, notes
+
+# Timelines are written in ticks, so section offsets land exactly on the notes' grid
+TICKS_PER_BEAT = 960
+
+# Write a layer's timeline: sections are (part MIDI file, duration in seconds, muted) in song
+# order. Every section starts with the tempo of its part at the tick where the previous one
+# ended, so it starts at the same time as in the mixed song. Notes are cut at the end of their
+# section, as the mix cuts each part's layers, while their release still rings into the next.
+def write_layer_timeline(filename, sections, track_name='Timeline'):
+    mf = MIDIFile(1, eventtime_is_ticks=True, ticks_per_quarternote=TICKS_PER_BEAT)
+    mf.addTrackName(0, 0, track_name)
+    offset = 0
+    # Parts repeat in the arrangement: read each file once
+    part_notes = {}
+    for midi_file, duration, muted in sections:
+        if midi_file not in part_notes:
+            part_notes[midi_file] = read_midi_notes(midi_file)
+        tempo, notes = part_notes[midi_file]
+        section_ticks = int(round(duration * tempo / 60 * TICKS_PER_BEAT))
+        mf.addTempo(0, offset, tempo)
+        if not muted:
+            for channel, pitch, start, note_duration, velocity in notes:
+                start_tick = int(round(start * TICKS_PER_BEAT))
+                end_tick = min(int(round((start + note_duration) * TICKS_PER_BEAT)), section_ticks)
+                if end_tick > start_tick:
+                    mf.addNote(0, channel, pitch, offset + start_tick, end_tick - start_tick, velocity)
+        offset += section_ticks
+    with open(filename, 'wb') as outf:
+        mf.writeFile(outf)
+    return filename
+
+# Reads a rendered layer section by section, from a WAV file or from samples in memory.
+# Audio shorter than the song is padded with silence.
+class LayerReader:
+    def __init__(self, source):
+        self.audio_file = None
+        self.samples = None
+        self.position = 0
+        if isinstance(source, str):
+            self.audio_file = AudioFile(source)
+        else:
+            self.samples = source
+
+    def read(self, frames):
+        if self.audio_file is not None:
+            remaining = self.audio_file.frames - self.audio_file.tell()
+            samples = self.audio_file.read(min(frames, remaining)) if remaining > 0 else np.zeros((self.audio_file.num_channels, 0), dtype=np.float32)
+        else:
+            samples = self.samples[:, self.position:self.position + frames]
+            self.position += frames
+        if samples.shape[1] < frames:
+            samples = np.pad(samples, ((0, 0), (0, frames - samples.shape[1])))
+        return samples
+
+    def close(self):
+        if self.audio_file is not None:
+            self.audio_file.close()
@@ -0,0 +1,199 @@
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# The resource module is Unix only: without it, bytes written and peak RSS are not recorded
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Lightweight tracing of where a song spends its time. A span is a named, timed block of work
+# with optional arguments (the part and layer it belongs to); spans opened inside other spans
+# on the same thread nest. Spans can be added up by stage, part or layer, and exported in the
+# Chrome trace event format, which chrome://tracing and https://ui.perfetto.dev can open.
+#
+# Functions take tracer=None and trace through span(tracer, ...), which does nothing without a tracer.
+#
+# With resources=True every span also records what it cost: CPU time of the process and of the
+# child processes it waited for (FluidSynth), subprocesses spawned, bytes written to disk (by the
+# process and its children), the peak Python memory allocated on top of what was in use when
+# it began (tracemalloc, which slows Python code down, hence optional) and the process RSS.
+# The counters are process wide, so spans running at the same time on other threads (effects,
+# part scoring) are included in each other's figures.
+
+# Spawned subprocesses, counted by an audit hook installed with the first resource tracer
+_subprocesses = 0
+_audit_hook_installed = False
+
+def _count_subprocesses(event, args):
+    global _subprocesses
+    if event in ('subprocess.Popen', 'os.system'):
+        _subprocesses += 1
+
+def _install_audit_hook():
+    global _audit_hook_installed
+    if not _audit_hook_installed:
+        sys.addaudithook(_count_subprocesses)
+        _audit_hook_installed = True
+
+# Resident set size of the process in bytes (Linux), None where /proc is not available
+def current_rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+def _max_rss_bytes(usage):
+    return usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+
+# Cumulative counters, subtracted at the end of a span
+def resource_counters():
+    times = os.times()
+    counters = {'cpu': time.process_time(), 'child_cpu': times.children_user + times.children_system,
+                'subprocesses': _subprocesses, 'memory': tracemalloc.get_traced_memory()[0]}
+    if resource is not None:
+        self_usage = resource.getrusage(resource.RUSAGE_SELF)
+        child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        # Output blocks are counted in 512 byte units
+        counters['bytes_written'] = (self_usage.ru_oublock + child_usage.ru_oublock) * 512
+    return counters
+
+def resource_usage(start_counters, peak_memory):
+    end_counters = resource_counters()
+    usage = {name: end_counters[name] - start_counters[name] for name in ('cpu', 'child_cpu', 'subprocesses', 'bytes_written')
+             if name in end_counters}
+    usage['peak_memory'] = max(peak_memory - start_counters['memory'], 0)
+    usage['rss'] = current_rss()
+    if resource is not None:
+        usage['max_rss'] = _max_rss_bytes(resource.getrusage(resource.RUSAGE_SELF))
+        usage['child_max_rss'] = _max_rss_bytes(resource.getrusage(resource.RUSAGE_CHILDREN))
+    return usage
+
+# Resources are added up over the spans of a stage, except memory figures, which keep the highest
+RESOURCE_MAXIMUMS = ('peak_memory', 'rss', 'max_rss', 'child_max_rss')
+
+class Tracer:
+    def __init__(self, resources=False):
+        self.origin = time.perf_counter()
+        self.spans = []
+        self.lock = threading.Lock()
+        self.resources = resources
+        self.started_tracemalloc = False
+        # Spans in progress, which the tracemalloc peak is handed to before each reset
+        self.open_spans = []
+        if resources:
+            _install_audit_hook()
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started_tracemalloc = True
+
+    # tracemalloc has a single peak: before restarting it for a new span, every open span
+    # keeps the peak reached so far
+    def update_peaks(self, reset=False):
+        peak = tracemalloc.get_traced_memory()[1]
+        for span in self.open_spans:
+            span['_peak_memory'] = max(span['_peak_memory'], peak)
+        if reset:
+            tracemalloc.reset_peak()
+
+    def begin(self, name, **args):
+        thread = threading.current_thread()
+        span = {'name': name, 'start': time.perf_counter() - self.origin, 'duration': None,
+                'thread_id': thread.ident, 'thread': thread.name, 'args': args}
+        if self.resources:
+            with self.lock:
+                self.update_peaks(reset=True)
+                span['_counters'] = resource_counters()
+                span['_peak_memory'] = span['_counters']['memory']
+                self.open_spans.append(span)
+        return span
+
+    def end(self, span):
+        span['duration'] = time.perf_counter() - self.origin - span['start']
+        with self.lock:
+            if self.resources:
+                self.update_peaks()
+                self.open_spans.remove(span)
+                span['resources'] = resource_usage(span.pop('_counters'), span.pop('_peak_memory'))
+            self.spans.append(span)
+        return span
+
+    # Stops tracemalloc if this tracer started it
+    def close(self):
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+            self.started_tracemalloc = False
+
+    @contextmanager
+    def span(self, name, **args):
+        span = self.begin(name, **args)
+        try:
+            yield span
+        finally:
+            self.end(span)
+
+    # Count and total seconds of the spans of every stage, or of every stage within each
+    # value of a span argument (key='part' gives the stages of every part)
+    def totals(self, key=None):
+        totals = {}
+        for span in self.spans:
+            if key is None:
+                stages = totals
+            elif key in span['args']:
+                stages = totals.setdefault(str(span['args'][key]), {})
+            else:
+                continue
+            stage = stages.setdefault(span['name'], {'count': 0, 'seconds': 0.0})
+            stage['count'] += 1
+            stage['seconds'] += span['duration']
+            for name, value in span.get('resources', {}).items():
+                if value is None:
+                    stage.setdefault(name, None)
+                elif name in RESOURCE_MAXIMUMS:
+                    stage[name] = max(stage.get(name) or 0, value)
+                else:
+                    stage[name] = stage.get(name, 0) + value
+        return totals
+
+    # Resources of the first span with this name (the whole song), None if not recorded
+    def resources_of(self, name):
+        for span in self.spans:
+            if span['name'] == name:
+                return span.get('resources')
+        return None
+
+    # Complete ('X') events in microseconds, one track per thread
+    def chrome_trace(self):
+        pid = os.getpid()
+        events = []
+        threads = {}
+        for span in sorted(self.spans, key=lambda span: span['start']):
+            threads[span['thread_id']] = span['thread']
+            events.append({'name': span['name'], 'cat': 'random_music', 'ph': 'X', 'pid': pid, 'tid': span['thread_id'],
+                           'ts': span['start'] * 1e6, 'dur': span['duration'] * 1e6,
+                           'args': dict(span['args'], **span.get('resources', {}))})
+        for thread_id, thread_name in threads.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread_id, 'args': {'name': thread_name}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save_chrome_trace(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+        return filename
+
+def span(tracer, name, **args):
+    if tracer is None:
+        return nullcontext()
+    return tracer.span(name, **args)
+
+# Run function(*args) inside a span, for work handed to a thread pool
+def call_in_span(tracer, name, span_args, function, *args):
+    with span(tracer, name, **span_args):
+        return function(*args)
@@ -0,0 +1,33 @@
+import os
+import shutil
+import tempfile
+
+# Scratch space for the intermediate files of a song or beat (part MIDI files, rendered and
+# processed layers), kept apart from its outputs. Each workspace is a fresh directory under
+# scratch_dir (the system temporary directory by default; a tmpfs such as /dev/shm keeps the
+# intermediates off the disk) and is removed when it is closed, whether generation succeeded
+# or failed, unless keep is set to leave the intermediates behind for debugging.
+#
+#     with Workspace(name, scratch_dir) as song_workspace:
+#         midi_file = song_workspace.file(name + '-verse-melody.mid')
+
+class Workspace:
+    def __init__(self, name, scratch_dir=None, keep=False):
+        if scratch_dir is not None:
+            os.makedirs(scratch_dir, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix=name + '_', dir=scratch_dir)
+        self.keep = keep
+
+    def file(self, filename):
+        return os.path.join(self.path, filename)
+
+    def close(self):
+        if not self.keep:
+            shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False